@@ -1,11 +1,852 @@
 from .extensions import NewelleExtension
-from gi.repository import Gtk, Gio
-import re
+from gi.repository import Gtk, Gio, GLib, Gdk, GdkPixbuf, Adw
+import cairo
+import re, os, io, sys, math, json, mmap, time, sqlite3, threading, urllib.request
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_TILE_SIZE = 256
+_MIN_ZOOM = 1
+_MAX_ZOOM = 19
+_TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+_TILE_USER_AGENT = "Newelle-collection/1.0 (osm_viewer extension)"
+_TILE_TIMEOUT = 10.0
+_TILE_WORKERS = 4
+_TILE_RETRY_SECS = 60
+_TILE_DISK_BYTES = 256 * 1024 * 1024
+_DISK_TRIM_RATIO = 0.9
+_SURFACE_CACHE_TILES = 256
+_PREFETCH_MARGIN = 1
+_FALLBACK_LEVELS = 4
+_VIEW_HEIGHT = 320
+_VIEW_FIT_WIDTH = 600
+_FIT_PADDING = 32
+_CLUSTER_CELL = 64
+_CLUSTER_LEVELS_CACHED = 6
+_CLUSTER_SYNC_POINTS = 20000
+_LABEL_LIMIT = 40
+_FILE_LABEL_LIMIT = 10000
+_GEOJSON_TYPES = {"FeatureCollection", "Feature", "GeometryCollection", "Point", "MultiPoint"}
+_HEAT_CELL = 4
+_HEAT_GRID_MAX = 1024
+_HEAT_BLUR = 4
+_HEAT_LEVELS_CACHED = 4
+_HEAT_OPACITY = 0.8
+_HEAT_STOPS = [(0.0, (0.0, 0.0, 1.0, 0.0)), (0.2, (0.0, 0.6, 1.0, 0.5)), (0.45, (0.0, 0.9, 0.3, 0.7)),
+               (0.7, (1.0, 0.9, 0.0, 0.85)), (1.0, (1.0, 0.1, 0.0, 0.95))]
+_GEOJSON_COORDS_RE = re.compile(rb'"coordinates"\s*:\s*(\[[-+0-9.eE,\s\[\]]*\])')
+_GEOJSON_PAIR_RE = re.compile(rb"\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)\s*(?:,\s*[-+0-9.eE]+\s*)*\]")
+_GPX_POINT_RE = re.compile(rb"<(?:wpt|trkpt|rtept)\b([^>]*)>")
+_GPX_ATTR_RE = re.compile(rb"""\b(lat|lon)\s*=\s*["']([-+0-9.eE]+)["']""")
+
+
+def _unit(lat: float, lon: float):
+    lat = max(-85.05112878, min(85.05112878, lat))
+    s = math.sin(math.radians(lat))
+    return (lon + 180.0) / 360.0, 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+
+
+def _unproject(x: float, y: float, zoom: int):
+    world = _TILE_SIZE * (1 << zoom)
+    lon = x / world * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / world))))
+    return lat, (lon + 180.0) % 360.0 - 180.0
+
+
+class _PointSet:
+    __slots__ = ("xs", "ys", "labels")
+
+    def __init__(self):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    def add(self, lat: float, lon: float, label: str = ""):
+        x, y = _unit(lat, lon)
+        if label:
+            self.labels[len(self.xs)] = label
+        self.xs.append(x)
+        self.ys.append(y)
+
+    def bounds(self):
+        return min(self.xs), min(self.ys), max(self.xs), max(self.ys)
+
+    def extend(self, other):
+        base = len(self.xs)
+        for i, label in other.labels.items():
+            self.labels[base + i] = label
+        self.xs.extend(other.xs)
+        self.ys.extend(other.ys)
+
+    def latlon(self, i: int):
+        return _unproject(self.xs[i] * _TILE_SIZE, self.ys[i] * _TILE_SIZE, 0)
+
+
+def _read_points_file(path: str) -> _PointSet:
+    points = _PointSet()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return points
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ext = os.path.splitext(path)[1].lower()
+            head = mm[:512].lstrip()
+            if ext in (".geojson", ".json") or head[:1] in (b"{", b"["):
+                _scan_geojson(mm, points)
+            elif ext == ".gpx" or head[:5] == b"<?xml" or head[:4] == b"<gpx":
+                _scan_gpx(mm, points)
+            else:
+                _scan_csv(mm, points)
+    return points
+
+
+def _scan_geojson(mm, points: _PointSet):
+    for block in _GEOJSON_COORDS_RE.finditer(mm):
+        for pair in _GEOJSON_PAIR_RE.finditer(mm, block.start(1), block.end(1)):
+            try:
+                points.add(float(pair.group(2)), float(pair.group(1)))
+            except ValueError:
+                pass
+
+
+def _scan_gpx(mm, points: _PointSet):
+    for tag in _GPX_POINT_RE.finditer(mm):
+        attrs = dict(_GPX_ATTR_RE.findall(tag.group(1)))
+        try:
+            points.add(float(attrs[b"lat"]), float(attrs[b"lon"]))
+        except (KeyError, ValueError):
+            pass
+
+
+def _scan_csv(mm, points: _PointSet):
+    ilat, ilon, ilabel = 0, 1, None
+    sep = b","
+    for line in iter(mm.readline, b""):
+        line = line.strip()
+        if not line or line[:1] == b"#":
+            continue
+        fields = line.split(sep)
+        if len(fields) < 2:
+            sep = b";" if b";" in line else b"\t"
+            fields = line.split(sep)
+        try:
+            lat = float(fields[ilat]); lon = float(fields[ilon])
+        except (ValueError, IndexError):
+            names = [f.strip().strip(b'"').lower() for f in fields]
+            for i, n in enumerate(names):
+                if n in (b"lat", b"latitude", b"y"):
+                    ilat = i
+                elif n in (b"lon", b"lng", b"long", b"longitude", b"x"):
+                    ilon = i
+                elif n in (b"name", b"title", b"label"):
+                    ilabel = i
+            continue
+        label = ""
+        if ilabel is not None and ilabel < len(fields) and len(points) < _FILE_LABEL_LIMIT:
+            label = fields[ilabel].strip().strip(b'"').decode("utf-8", "replace")
+        points.add(lat, lon, label)
+
+
+def _heat_tables(peak: int) -> list:
+    rgba = []
+    for v in range(256):
+        t = min(1.0, v / float(max(1, peak)))
+        for (t0, c0), (t1, c1) in zip(_HEAT_STOPS, _HEAT_STOPS[1:]):
+            if t <= t1:
+                f = (t - t0) / (t1 - t0)
+                rgba.append(tuple(a + (b - a) * f for a, b in zip(c0, c1)))
+                break
+    order = (2, 1, 0, 3) if sys.byteorder == "little" else (3, 0, 1, 2)
+    return [bytes(int(round(255 * (c[ch] * c[3] if ch < 3 else c[3]))) if v else 0 for v, c in enumerate(rgba)) for ch in order]
+
+
+def _blur_a8(src, w: int, h: int, radius: int):
+    sw, sh = max(1, w // radius), max(1, h // radius)
+    small = cairo.ImageSurface(cairo.FORMAT_A8, sw, sh)
+    cr = cairo.Context(small)
+    cr.scale(sw / w, sh / h)
+    cr.set_source_surface(src, 0, 0)
+    cr.get_source().set_filter(cairo.FILTER_GOOD)
+    cr.paint()
+    out = cairo.ImageSurface(cairo.FORMAT_A8, w, h)
+    cr = cairo.Context(out)
+    cr.scale(w / sw, h / sh)
+    cr.set_source_surface(small, 0, 0)
+    cr.get_source().set_filter(cairo.FILTER_BILINEAR)
+    cr.paint()
+    out.flush()
+    return out
+
+
+class _HeatLayer:
+    def __init__(self, points: _PointSet):
+        self.points = points
+        self.bounds = points.bounds()
+        self._levels = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def grid_zoom(self, z: int) -> int:
+        x0, y0, x1, y1 = self.bounds
+        extent = max(x1 - x0, y1 - y0, 1e-9) * _TILE_SIZE / _HEAT_CELL
+        while z > 0 and extent * (1 << z) > _HEAT_GRID_MAX:
+            z -= 1
+        return z
+
+    def peek(self, z: int):
+        gz = self.grid_zoom(z)
+        with self._lock:
+            lvl = self._levels.get(gz)
+            if lvl is not None:
+                self._levels.move_to_end(gz)
+                return lvl, True
+            near = min(self._levels, key=lambda k: abs(k - gz), default=None)
+            return (self._levels[near] if near is not None else None), False
+
+    def request(self, z: int, callback):
+        gz = self.grid_zoom(z)
+        with self._lock:
+            if gz in self._pending or gz in self._levels:
+                return
+            self._pending.add(gz)
+        def run():
+            try:
+                lvl = self._render(gz)
+                with self._lock:
+                    self._levels[gz] = lvl
+                    while len(self._levels) > _HEAT_LEVELS_CACHED:
+                        self._levels.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._pending.discard(gz)
+            GLib.idle_add(callback)
+        _get_executor().submit(run)
+
+    def _render(self, gz: int):
+        x0, y0, x1, y1 = self.bounds
+        cell = _HEAT_CELL / float(_TILE_SIZE << gz)
+        pad = 2 * _HEAT_BLUR
+        gx0 = x0 - pad * cell; gy0 = y0 - pad * cell
+        w = (int((x1 - x0) / cell) + 1 + 2 * pad + 3) & ~3
+        h = int((y1 - y0) / cell) + 1 + 2 * pad
+        bins = array("I", bytes(4 * w * h))
+        cells = []
+        inv = 1.0 / cell
+        xs, ys = self.points.xs, self.points.ys
+        for i in range(len(xs)):
+            k = int((ys[i] - gy0) * inv) * w + int((xs[i] - gx0) * inv)
+            if not bins[k]:
+                cells.append(k)
+            bins[k] += 1
+        scale = 255.0 / math.log1p(max((bins[k] for k in cells), default=1))
+        levels = bytearray(w * h)
+        for k in cells:
+            levels[k] = min(255, int(math.log1p(bins[k]) * scale))
+        density = cairo.ImageSurface.create_for_data(levels, cairo.FORMAT_A8, w, h, w)
+        blurred = _blur_a8(density, w, h, _HEAT_BLUR)
+        stride = blurred.get_stride()
+        data = bytes(blurred.get_data())
+        if stride != w:
+            data = b"".join(data[r * stride:r * stride + w] for r in range(h))
+        rgba = bytearray(4 * w * h)
+        for ch, table in enumerate(_heat_tables(max(data))):
+            rgba[ch::4] = data.translate(table)
+        surface = cairo.ImageSurface.create_for_data(rgba, cairo.FORMAT_ARGB32, w, h, 4 * w)
+        return surface, gx0, gy0, cell
+
+
+class _ClusterIndex:
+    def __init__(self, points: _PointSet):
+        self.points = points
+        self._levels = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def peek(self, z: int):
+        with self._lock:
+            lvl = self._levels.get(z)
+            if lvl is not None:
+                self._levels.move_to_end(z)
+            return lvl
+
+    def level(self, z: int):
+        lvl = self.peek(z)
+        if lvl is not None:
+            return lvl
+        with self._lock:
+            finer = self._levels.get(z + 1)
+        lvl = self._merge(finer) if finer is not None else self._build(z)
+        with self._lock:
+            self._levels[z] = lvl
+            while len(self._levels) > _CLUSTER_LEVELS_CACHED:
+                self._levels.popitem(last=False)
+        return lvl
+
+    def request(self, z: int, callback):
+        with self._lock:
+            if z in self._pending:
+                return
+            self._pending.add(z)
+        def run():
+            try:
+                self.level(z)
+            finally:
+                with self._lock:
+                    self._pending.discard(z)
+            GLib.idle_add(callback)
+        _get_executor().submit(run)
+
+    def _build(self, z: int):
+        scale = float(_TILE_SIZE << z) / _CLUSTER_CELL
+        slots = {}
+        counts = array("l"); sx = array("d"); sy = array("d"); reps = array("l")
+        xs, ys = self.points.xs, self.points.ys
+        for i in range(len(xs)):
+            x = xs[i]; y = ys[i]
+            key = int(x * scale) << 32 | int(y * scale)
+            j = slots.get(key)
+            if j is None:
+                slots[key] = len(counts)
+                counts.append(1); sx.append(x); sy.append(y); reps.append(i)
+            else:
+                counts[j] += 1; sx[j] += x; sy[j] += y
+        return slots, counts, sx, sy, reps
+
+    def _merge(self, finer):
+        fslots, fcounts, fsx, fsy, freps = finer
+        slots = {}
+        counts = array("l"); sx = array("d"); sy = array("d"); reps = array("l")
+        for key, k in fslots.items():
+            key = (key >> 33) << 32 | (key & 0xFFFFFFFF) >> 1
+            j = slots.get(key)
+            if j is None:
+                slots[key] = len(counts)
+                counts.append(fcounts[k]); sx.append(fsx[k]); sy.append(fsy[k]); reps.append(freps[k])
+            else:
+                counts[j] += fcounts[k]; sx[j] += fsx[k]; sy[j] += fsy[k]
+        return slots, counts, sx, sy, reps
+
+    def visible(self, lvl, z: int, x0: float, y0: float, w: float, h: float):
+        slots, counts, sx, sy, reps = lvl
+        world = float(_TILE_SIZE << z)
+        ncells = (_TILE_SIZE << z) // _CLUSTER_CELL
+        cy0 = max(0, math.floor(y0 / _CLUSTER_CELL)); cy1 = min(ncells - 1, math.floor((y0 + h) / _CLUSTER_CELL))
+        for cx in range(math.floor(x0 / _CLUSTER_CELL), math.floor((x0 + w) / _CLUSTER_CELL) + 1):
+            base = (cx % ncells) << 32
+            off = (cx // ncells) * world
+            for cy in range(cy0, cy1 + 1):
+                j = slots.get(base | cy)
+                if j is None:
+                    continue
+                c = counts[j]
+                yield sx[j] / c * world + off, sy[j] / c * world, c, reps[j]
+
+
+class _MBTiles:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect("file:" + urllib.request.pathname2url(self.path) + "?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, z: int, x: int, y: int):
+        row = self._conn().execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, (1 << z) - 1 - y)).fetchone()
+        return bytes(row[0]) if row else None
+
+
+class _DiskTiles:
+    def __init__(self, directory: str, max_bytes: int = _TILE_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), f"{y}.png")
+
+    def get(self, z: int, x: int, y: int):
+        path = self._path(z, x, y)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, z: int, x: int, y: int, data: bytes):
+        path = self._path(z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                old = os.path.getsize(path)
+            except OSError:
+                old = 0
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._trim(len(data) - old)
+
+    def _trim(self, added: int):
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += added
+                if self._bytes <= self.max_bytes:
+                    return
+            files = []
+            for root, _dirs, names in os.walk(self.directory):
+                for fn in names:
+                    if fn.endswith(".png"):
+                        path = os.path.join(root, fn)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        files.append((st.st_mtime, st.st_size, path))
+            total = sum(f[1] for f in files)
+            if total > self.max_bytes:
+                files.sort()
+                for mtime, size, path in files:
+                    if total <= self.max_bytes * _DISK_TRIM_RATIO:
+                        break
+                    try:
+                        os.remove(path)
+                        total -= size
+                    except OSError:
+                        pass
+            self._bytes = total
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_TILE_WORKERS, thread_name_prefix="newelle-map")
+        return _executor
+
+
+def _decode_tile(data: bytes):
+    try:
+        return cairo.ImageSurface.create_from_png(io.BytesIO(data))
+    except Exception:
+        pass
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(data)
+    loader.close()
+    pixbuf = loader.get_pixbuf()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, pixbuf.get_width(), pixbuf.get_height())
+    cr = cairo.Context(surface)
+    Gdk.cairo_set_source_pixbuf(cr, pixbuf, 0, 0)
+    cr.paint()
+    return surface
+
+
+class _TileSource:
+    def __init__(self, mbtiles_path: str, url: str, download: bool):
+        self.mbtiles = _MBTiles(mbtiles_path) if mbtiles_path and os.path.isfile(mbtiles_path) else None
+        self.disk = _DiskTiles(os.path.join(GLib.get_user_cache_dir(), "newelle", "map", "tiles"))
+        self.url = url or _TILE_URL
+        self.download = download
+        self._surfaces = OrderedDict()
+        self._pending = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def cached(self, key):
+        with self._lock:
+            surface = self._surfaces.get(key)
+            if surface is not None:
+                self._surfaces.move_to_end(key)
+            return surface
+
+    def request(self, key, callback=None):
+        with self._lock:
+            if key in self._surfaces:
+                return
+            if time.time() < self._failed.get(key, 0):
+                return
+            waiters = self._pending.get(key)
+            if waiters is not None:
+                if callback is not None and callback not in waiters:
+                    waiters.append(callback)
+                return
+            self._pending[key] = [callback] if callback is not None else []
+        _get_executor().submit(self._load, key)
+
+    def _load(self, key):
+        surface = None
+        try:
+            data = self._read(*key)
+            if data is not None:
+                surface = _decode_tile(data)
+        except Exception:
+            surface = None
+        with self._lock:
+            waiters = self._pending.pop(key, [])
+            if surface is None:
+                self._failed[key] = time.time() + _TILE_RETRY_SECS
+                return
+            self._failed.pop(key, None)
+            self._surfaces[key] = surface
+            while len(self._surfaces) > _SURFACE_CACHE_TILES:
+                self._surfaces.popitem(last=False)
+        for cb in waiters:
+            GLib.idle_add(cb)
+
+    def _read(self, z, x, y):
+        if self.mbtiles is not None:
+            try:
+                data = self.mbtiles.get(z, x, y)
+            except sqlite3.Error:
+                data = None
+            if data is not None:
+                return data
+        data = self.disk.get(z, x, y)
+        if data is not None or not self.download:
+            return data
+        req = urllib.request.Request(self.url.format(z=z, x=x, y=y), headers={"User-Agent": _TILE_USER_AGENT})
+        with urllib.request.urlopen(req, timeout=_TILE_TIMEOUT) as resp:
+            data = resp.read()
+        self.disk.put(z, x, y, data)
+        return data
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def _get_source(mbtiles_path: str, url: str, download: bool) -> _TileSource:
+    key = (mbtiles_path or "", url or _TILE_URL, bool(download))
+    with _sources_lock:
+        source = _sources.get(key)
+        if source is None:
+            source = _TileSource(*key)
+            _sources[key] = source
+        return source
+
+
+class _MapView:
+    def __init__(self, source: _TileSource, points: _PointSet, zoom: int | None, title: str, heatmap: bool = False):
+        self.source = source
+        self.points = points
+        self.index = _ClusterIndex(points)
+        self.heat = _HeatLayer(points) if heatmap else None
+        self.title = title
+        self.pointer = None
+        self._fit = zoom is None
+        self.zoom = zoom if zoom is not None else self._fit_zoom(_VIEW_FIT_WIDTH, _VIEW_HEIGHT)
+        x0, y0, x1, y1 = points.bounds()
+        world = float(_TILE_SIZE << self.zoom)
+        self.cx, self.cy = (x0 + x1) / 2 * world, (y0 + y1) / 2 * world
+        self.area = Gtk.DrawingArea(hexpand=True)
+        self.area.set_content_height(_VIEW_HEIGHT)
+        self.area.set_draw_func(self._draw)
+        drag = Gtk.GestureDrag()
+        drag.connect("drag-begin", self._on_drag_begin)
+        drag.connect("drag-update", self._on_drag_update)
+        self.area.add_controller(drag)
+        scroll = Gtk.EventControllerScroll.new(Gtk.EventControllerScrollFlags.VERTICAL | Gtk.EventControllerScrollFlags.DISCRETE)
+        scroll.connect("scroll", self._on_scroll)
+        self.area.add_controller(scroll)
+        motion = Gtk.EventControllerMotion()
+        motion.connect("motion", lambda _c, x, y: setattr(self, "pointer", (x, y)))
+        self.area.add_controller(motion)
+        click = Gtk.GestureClick()
+        click.connect("pressed", self._on_click)
+        self.area.add_controller(click)
+
+    def _on_drag_begin(self, _g, _x, _y):
+        self._drag_origin = (self.cx, self.cy)
+
+    def _on_drag_update(self, _g, dx, dy):
+        ox, oy = self._drag_origin
+        self.cx, self.cy = ox - dx, oy - dy
+        self.area.queue_draw()
+
+    def _on_scroll(self, _c, _dx, dy):
+        if dy != 0:
+            self.zoom_by(-1 if dy > 0 else 1, self.pointer)
+        return True
+
+    def _on_click(self, _g, n_press, x, y):
+        if n_press == 2:
+            self.zoom_by(1, (x, y))
+
+    def center(self):
+        return _unproject(self.cx, self.cy, self.zoom)
+
+    def _fit_zoom(self, w: int, h: int) -> int:
+        x0, y0, x1, y1 = self.points.bounds()
+        span = max((x1 - x0) / max(1, w - 2 * _FIT_PADDING), (y1 - y0) / max(1, h - 2 * _FIT_PADDING))
+        if span <= 0:
+            return 14
+        return max(_MIN_ZOOM, min(_MAX_ZOOM, int(math.floor(math.log2(1.0 / (span * _TILE_SIZE))))))
+
+    def zoom_by(self, step: int, anchor=None):
+        zoom = max(_MIN_ZOOM, min(_MAX_ZOOM, self.zoom + step))
+        if zoom == self.zoom:
+            return
+        w, h = self.area.get_width(), self.area.get_height()
+        ax, ay = (anchor if anchor is not None else (w / 2, h / 2))
+        ax -= w / 2; ay -= h / 2
+        f = 2.0 ** (zoom - self.zoom)
+        self.cx = (self.cx + ax) * f - ax
+        self.cy = (self.cy + ay) * f - ay
+        self.zoom = zoom
+        self.area.queue_draw()
+
+    def _on_tile(self):
+        self.area.queue_draw()
+        return False
+
+    def _draw(self, _a, cr, w, h):
+        if self._fit:
+            self._fit = False
+            zoom = self._fit_zoom(w, h)
+            if zoom != self.zoom:
+                f = 2.0 ** (zoom - self.zoom)
+                self.cx *= f; self.cy *= f; self.zoom = zoom
+        cr.set_source_rgb(0.87, 0.87, 0.85)
+        cr.paint()
+        z = self.zoom
+        n = 1 << z
+        x0 = self.cx - w / 2.0
+        y0 = self.cy - h / 2.0
+        tx0 = math.floor(x0 / _TILE_SIZE); tx1 = math.floor((x0 + w - 1) / _TILE_SIZE)
+        ty0 = max(0, math.floor(y0 / _TILE_SIZE)); ty1 = min(n - 1, math.floor((y0 + h - 1) / _TILE_SIZE))
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                key = (z, tx % n, ty)
+                px = tx * _TILE_SIZE - x0; py = ty * _TILE_SIZE - y0
+                surface = self.source.cached(key)
+                if surface is not None:
+                    cr.set_source_surface(surface, px, py)
+                    cr.rectangle(px, py, _TILE_SIZE, _TILE_SIZE)
+                    cr.fill()
+                    continue
+                self.source.request(key, self._on_tile)
+                self._draw_fallback(cr, key, px, py)
+        m = _PREFETCH_MARGIN
+        for ty in range(max(0, ty0 - m), min(n - 1, ty1 + m) + 1):
+            for tx in range(tx0 - m, tx1 + m + 1):
+                if ty0 <= ty <= ty1 and tx0 <= tx <= tx1:
+                    continue
+                self.source.request((z, tx % n, ty))
+        if self.heat is None or not self._draw_heat(cr, x0, y0):
+            self._draw_points(cr, x0, y0, w, h)
+        cr.set_source_rgba(0, 0, 0, 0.6)
+        cr.set_font_size(10)
+        text = "© OpenStreetMap contributors"
+        ext = cr.text_extents(text)
+        cr.move_to(w - ext.x_advance - 6, h - 6)
+        cr.show_text(text)
+
+    def _draw_fallback(self, cr, key, px, py):
+        z, x, y = key
+        for dz in range(1, _FALLBACK_LEVELS + 1):
+            if z - dz < 0:
+                break
+            parent = self.source.cached((z - dz, x >> dz, y >> dz))
+            if parent is None:
+                continue
+            scale = float(1 << dz)
+            mask = (1 << dz) - 1
+            sub = _TILE_SIZE / scale
+            cr.save()
+            cr.rectangle(px, py, _TILE_SIZE, _TILE_SIZE)
+            cr.clip()
+            cr.translate(px, py)
+            cr.scale(scale, scale)
+            cr.set_source_surface(parent, -(x & mask) * sub, -(y & mask) * sub)
+            cr.paint()
+            cr.restore()
+            return
+        cr.set_source_rgba(0, 0, 0, 0.08)
+        cr.set_line_width(1.0)
+        cr.rectangle(px + 0.5, py + 0.5, _TILE_SIZE - 1, _TILE_SIZE - 1)
+        cr.stroke()
+
+    def _draw_heat(self, cr, x0, y0) -> bool:
+        lvl, exact = self.heat.peek(self.zoom)
+        if not exact:
+            self.heat.request(self.zoom, self._on_tile)
+        if lvl is not None:
+            surface, gx0, gy0, cell = lvl
+            world = float(_TILE_SIZE << self.zoom)
+            cr.save()
+            cr.translate(gx0 * world - x0, gy0 * world - y0)
+            cr.scale(cell * world, cell * world)
+            cr.set_source_surface(surface, 0, 0)
+            cr.get_source().set_filter(cairo.FILTER_BILINEAR)
+            cr.paint_with_alpha(_HEAT_OPACITY)
+            cr.restore()
+        return self.heat.grid_zoom(self.zoom) >= self.zoom - 2
+
+    def _draw_points(self, cr, x0, y0, w, h):
+        lvl = self.index.peek(self.zoom)
+        if lvl is None:
+            if len(self.points) > _CLUSTER_SYNC_POINTS:
+                self.index.request(self.zoom, self._on_tile)
+                return
+            lvl = self.index.level(self.zoom)
+        pad = _CLUSTER_CELL / 2
+        singles = []
+        for x, y, count, rep in self.index.visible(lvl, self.zoom, x0 - pad, y0 - pad, w + 2 * pad, h + 2 * pad):
+            if count == 1:
+                singles.append((x - x0, y - y0, rep))
+            else:
+                self._draw_cluster(cr, x - x0, y - y0, count)
+        labels = len(singles) <= _LABEL_LIMIT
+        for mx, my, rep in singles:
+            label = self.points.labels.get(rep) or (self.title if len(self.points) == 1 else "")
+            self._draw_marker(cr, mx, my, label if labels else "")
+
+    def _draw_cluster(self, cr, mx, my, count):
+        r = 10 + 4 * math.log10(count)
+        cr.arc(mx, my, r, 0, 2 * math.pi)
+        cr.set_source_rgba(0.2, 0.4, 0.85, 0.85)
+        cr.fill_preserve()
+        cr.set_source_rgb(1, 1, 1)
+        cr.set_line_width(2)
+        cr.stroke()
+        text = f"{count / 1000:.1f}k" if count >= 10000 else str(count)
+        cr.set_font_size(11)
+        ext = cr.text_extents(text)
+        cr.move_to(mx - ext.x_advance / 2, my + ext.height / 2)
+        cr.show_text(text)
+
+    def _draw_marker(self, cr, mx, my, label):
+        cr.arc(mx, my, 7, 0, 2 * math.pi)
+        cr.set_source_rgb(0.86, 0.2, 0.18)
+        cr.fill_preserve()
+        cr.set_source_rgb(1, 1, 1)
+        cr.set_line_width(2)
+        cr.stroke()
+        if label:
+            cr.set_font_size(12)
+            ext = cr.text_extents(label)
+            cr.rectangle(mx + 10, my - ext.height - 6, ext.x_advance + 8, ext.height + 8)
+            cr.set_source_rgba(1, 1, 1, 0.85)
+            cr.fill()
+            cr.set_source_rgb(0.1, 0.1, 0.1)
+            cr.move_to(mx + 14, my - 2)
+            cr.show_text(label)
+
+
+class _TabPool:
+    def __init__(self):
+        self._tabs = OrderedDict()
+
+    def open(self, ui_controller, url: str, cap: int):
+        cap = max(1, cap)
+        for tab in [t for t in self._tabs if not self._alive(t)]:
+            del self._tabs[tab]
+        for tab, shown in self._tabs.items():
+            if shown == url:
+                self._tabs.move_to_end(tab)
+                self._select(tab)
+                return tab
+        while len(self._tabs) > cap:
+            self._close(self._tabs.popitem(last=False)[0])
+        if len(self._tabs) >= cap:
+            tab = next(iter(self._tabs))
+            if self._navigate(tab, url):
+                self._tabs[tab] = url
+                self._tabs.move_to_end(tab)
+                self._select(tab)
+                return tab
+            self._tabs.pop(tab)
+            self._close(tab)
+        tab = ui_controller.new_browser_tab(url, new=True)
+        if tab is not None:
+            self._tabs[tab] = url
+        return tab
+
+    def _alive(self, tab) -> bool:
+        child = tab.get_child()
+        return child is not None and child.get_root() is not None
+
+    def _navigate(self, tab, url: str) -> bool:
+        child = tab.get_child()
+        if hasattr(child, "navigate_to"):
+            child.navigate_to(url)
+            return True
+        webview = getattr(child, "webview", None)
+        if webview is not None:
+            webview.load_uri(url)
+            return True
+        return False
+
+    def _select(self, tab):
+        view = tab.get_child().get_ancestor(Adw.TabView)
+        if view is not None:
+            view.set_selected_page(tab)
+
+    def _close(self, tab):
+        child = tab.get_child()
+        view = child.get_ancestor(Adw.TabView) if child is not None else None
+        if view is not None:
+            view.close_page(tab)
+
+
+_tab_pool = _TabPool()
+
 
 class OSMViewerExtension(NewelleExtension):
     id = "osm_viewer"
     name = "OpenStreetMap Viewer"
 
+    def get_extra_settings(self) -> list:
+        return [
+            {
+                "key": "map_mbtiles",
+                "title": "MBTiles file",
+                "description": "Path to a local raster MBTiles file used before the tile cache and the network",
+                "type": "entry",
+                "default": "",
+            },
+            {
+                "key": "map_tile_url",
+                "title": "Tile server",
+                "description": "URL template for downloading missing tiles",
+                "type": "entry",
+                "default": _TILE_URL,
+            },
+            {
+                "key": "map_download",
+                "title": "Download missing tiles",
+                "description": "Fetch tiles that are not in the MBTiles file or the tile cache; disable to stay fully offline",
+                "type": "toggle",
+                "default": True,
+            },
+            {
+                "key": "map_tab_limit",
+                "title": "Browser tabs",
+                "description": "How many map tabs to keep open; further links reuse the least recently used one",
+                "type": "combo",
+                "values": ["1", "2", "4", "8"],
+                "default": "2",
+            },
+        ]
+
     def get_replace_codeblocks_langs(self) -> list:
         return ["map"]
 
@@ -19,60 +860,162 @@ class OSMViewerExtension(NewelleExtension):
                 "editable": True,
                 "show_in_settings": True,
                 "default": True,
-                "text": "To show a map, output only a single code block with language map. Formats supported:\n- `lat, lon` (optional third number = zoom)\n- or key/value lines, e.g.:\n```map\nlat: 55.751244\nlon: 37.618423\nzoom: 13\ntitle: Moscow Center\n```"
+                "text": "To show a map, output only a single code block with language map. Formats supported:\n- `lat, lon` (optional third number = zoom)\n- or key/value lines, e.g.:\n```map\nlat: 55.751244\nlon: 37.618423\nzoom: 13\ntitle: Moscow Center\n```\n- or many points, one `lat, lon, label` line each (optional `title:` and `zoom:` lines), e.g.:\n```map\ntitle: Stations\n55.7558, 37.6173, Okhotny Ryad\n55.7601, 37.6186, Teatralnaya\n```\n- or a GeoJSON Point/MultiPoint/FeatureCollection object\n- or `file: /path/to/points.csv` (CSV, GeoJSON or GPX) for large local datasets; add `mode: heatmap` to draw dense point sets as a density heatmap"
             }
         ]
 
     def get_gtk_widget(self, codeblock: str, lang: str) -> Gtk.Widget | None:
         if lang != "map":
             return None
-        lat, lon, zoom, title = self._parse_coords(codeblock)
-        if lat is None or lon is None:
+        points, zoom, title, opts = self._parse_coords(codeblock)
+        heatmap = opts.get("heatmap", False)
+        if opts.get("path"):
+            return self._build_file_map(opts["path"], points, zoom, title, heatmap)
+        if not len(points):
             return None
-        btn = Gtk.Button()
+        return self._build_map(points, zoom, title, heatmap)
+
+    def _build_file_map(self, path: str, inline: _PointSet, zoom, title: str, heatmap: bool = False):
+        holder = Gtk.Box(hexpand=True, height_request=_VIEW_HEIGHT)
+        status = Gtk.Label(label=f"Loading {os.path.basename(path)}…", hexpand=True)
+        status.add_css_class("dim-label")
+        holder.append(status)
+        def done(points, error):
+            if error is not None or not len(points):
+                status.set_text(f"Cannot show {os.path.basename(path)}: {error or 'no points found'}")
+                return False
+            holder.remove(status)
+            holder.append(self._build_map(points, zoom, title or os.path.basename(path), heatmap))
+            return False
+        def load():
+            try:
+                points = _read_points_file(path)
+                points.extend(inline)
+                GLib.idle_add(done, points, None)
+            except (OSError, ValueError) as e:
+                GLib.idle_add(done, None, e)
+        _get_executor().submit(load)
+        return holder
+
+    def _build_map(self, points: _PointSet, zoom, title: str, heatmap: bool = False):
+        source = _get_source(self.get_setting("map_mbtiles") or "", self.get_setting("map_tile_url") or _TILE_URL, bool(self.get_setting("map_download")))
+        view = _MapView(source, points, zoom, title, heatmap)
+        btn = Gtk.Button(halign=Gtk.Align.END, valign=Gtk.Align.START, margin_top=8, margin_end=8)
         btn.add_css_class("pill")
         btn.add_css_class("suggested-action")
         btn.set_tooltip_text("Open on OpenStreetMap")
         btn.set_child(Gtk.Image.new_from_icon_name("mark-location-symbolic"))
-        btn.connect("clicked", lambda _b: self._open_map_tab(lat, lon, zoom, title))
-        return btn
+        btn.connect("clicked", lambda _b: self._open_map_tab(*(points.latlon(0) if len(points) == 1 else view.center()), view.zoom, title))
+        overlay = Gtk.Overlay(hexpand=True)
+        overlay.set_child(view.area)
+        overlay.add_overlay(btn)
+        return overlay
 
     def _open_map_tab(self, lat: float, lon: float, zoom: int, title: str):
         url = f"https://www.openstreetmap.org/?mlat={lat:.6f}&mlon={lon:.6f}#map={zoom}/{lat:.6f}/{lon:.6f}"
-        tab = self.ui_controller.new_browser_tab(url, new=True)
+        tab = _tab_pool.open(self.ui_controller, url, int(self.get_setting("map_tab_limit") or 2))
         if tab is not None:
             tab.set_title(title if title else f"{lat:.5f},{lon:.5f}")
             tab.set_icon(Gio.ThemedIcon.new("mark-location-symbolic"))
 
     def _parse_coords(self, text: str):
-        zoom = 14
+        points = _PointSet()
+        zoom = None
         title = ""
+        body = (text or "").strip()
+        if body[:1] == "{":
+            try:
+                obj = json.loads(body)
+                if isinstance(obj, dict) and obj.get("type") in _GEOJSON_TYPES:
+                    self._collect_geojson(obj, points)
+                    if len(points):
+                        return points, None, "", {}
+            except Exception:
+                pass
+            points = _PointSet()
         kv = {}
-        for line in (text or "").splitlines():
-            if ":" in line:
+        rows = []
+        for line in body.splitlines():
+            if re.match(r"\s*[A-Za-z_]+\s*:", line):
                 k, v = line.split(":", 1)
                 kv[k.strip().lower()] = v.strip()
+            elif line.strip():
+                rows.append(line)
+        if "zoom" in kv:
+            try:
+                zoom = max(1, min(19, int(re.findall(r"\d+", kv["zoom"])[0])))
+            except IndexError:
+                pass
+        title = kv.get("title", "")
+        path = os.path.expanduser(kv.get("file") or kv.get("path") or "")
+        opts = {"path": path, "heatmap": kv.get("mode", "").lower() == "heatmap" or kv.get("heatmap", "").lower() in ("1", "true", "yes", "on")}
         if "lat" in kv and "lon" in kv:
             try:
-                lat = float(kv["lat"])
-                lon = float(kv["lon"])
-                if "zoom" in kv:
-                    zoom = max(1, min(19, int(re.findall(r"\d+", kv["zoom"])[0])))
-                title = kv.get("title", "")
-                return lat, lon, zoom, title
-            except Exception:
+                points.add(float(kv["lat"]), float(kv["lon"]))
+                return points, zoom or 14, title, opts
+            except ValueError:
                 pass
+        self._collect_rows(rows, points)
+        if not len(points) and not path:
+            nums = re.findall(r"[-+]?\d+(?:\.\d+)?", body)
+            if len(nums) >= 2:
+                points.add(float(nums[0]), float(nums[1]))
+                return points, zoom or 14, title, opts
+        if len(points) == 1 and zoom is None and not path:
+            nums = re.findall(r"[-+]?\d+(?:\.\d+)?", rows[0] if rows else "")
+            if len(nums) >= 3 and not points.labels.get(0, "").strip("-+.0123456789 "):
+                try:
+                    zoom = max(1, min(19, int(float(nums[2]))))
+                except ValueError:
+                    pass
+                points.labels.pop(0, None)
+            zoom = zoom or 14
+        return points, zoom, title, opts
 
-        nums = re.findall(r"[-+]?\d+(?:\.\d+)?", text or "")
-        if len(nums) >= 2:
+    def _collect_rows(self, rows: list, points: _PointSet):
+        ilat, ilon, ilabel = 0, 1, None
+        for line in rows:
+            fields = [f.strip() for f in re.split(r"[,;\t]", line)]
+            if len(fields) < 2:
+                fields = line.split()
             try:
-                lat = float(nums[0]); lon = float(nums[1])
-                if len(nums) >= 3:
-                    try:
-                        zoom = max(1, min(19, int(float(nums[2]))))
-                    except Exception:
-                        pass
-                return lat, lon, zoom, title
-            except Exception:
-                return None, None, zoom, title
-        return None, None, zoom, title
+                lat = float(fields[ilat]); lon = float(fields[ilon])
+            except (ValueError, IndexError):
+                names = [f.lower() for f in fields]
+                for i, n in enumerate(names):
+                    if n in ("lat", "latitude", "y"):
+                        ilat = i
+                    elif n in ("lon", "lng", "long", "longitude", "x"):
+                        ilon = i
+                    elif n in ("name", "title", "label"):
+                        ilabel = i
+                continue
+            if ilabel is not None:
+                label = fields[ilabel] if ilabel < len(fields) else ""
+            else:
+                label = ", ".join(f for i, f in enumerate(fields) if i not in (ilat, ilon))
+            points.add(lat, lon, label)
+
+    def _collect_geojson(self, obj, points: _PointSet, label: str = ""):
+        if isinstance(obj, list):
+            for item in obj:
+                self._collect_geojson(item, points)
+            return
+        kind = obj.get("type")
+        if kind == "FeatureCollection":
+            for feat in obj.get("features") or []:
+                self._collect_geojson(feat, points)
+        elif kind == "Feature":
+            props = obj.get("properties") or {}
+            name = props.get("name") or props.get("title") or props.get("label") or ""
+            if obj.get("geometry"):
+                self._collect_geojson(obj["geometry"], points, str(name))
+        elif kind == "GeometryCollection":
+            for geom in obj.get("geometries") or []:
+                self._collect_geojson(geom, points, label)
+        elif kind == "Point":
+            lon, lat = obj["coordinates"][:2]
+            points.add(float(lat), float(lon), label)
+        elif kind == "MultiPoint":
+            for lon, lat, *_ in obj["coordinates"]:
+                points.add(float(lat), float(lon), label)
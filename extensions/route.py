@@ -1,11 +1,435 @@
 from .extensions import NewelleExtension
-from gi.repository import Gtk, Gio
-import re
+from gi.repository import Gtk, Gio, GLib, Adw
+import cairo
+import re, os, bz2, gzip, math, mmap, time, heapq, bisect, struct, hashlib, threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+
+_GRAPH_MAGIC = b"NWRG0001"
+_GRAPH_HEADER = struct.Struct("<8sIII")
+_GRID_DEG = 0.01
+_SNAP_CELLS = 2
+_CONTEXT_EDGES = 20000
+_ROUTE_VIEW_HEIGHT = 260
+_EARTH_RADIUS = 6371008.8
+_HIGHWAY_CLASSES = ["motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link", "secondary", "secondary_link",
+                    "tertiary", "tertiary_link", "unclassified", "residential", "living_street", "service", "road",
+                    "track", "cycleway", "path", "footway", "pedestrian", "steps", "bridleway"]
+_PROFILE_BITS = {"car": 1, "bike": 2, "foot": 4}
+_CAR_SPEEDS = {"motorway": 110, "motorway_link": 60, "trunk": 90, "trunk_link": 50, "primary": 70, "primary_link": 50,
+               "secondary": 60, "secondary_link": 40, "tertiary": 50, "tertiary_link": 30, "unclassified": 40,
+               "residential": 30, "living_street": 10, "service": 15, "road": 30, "track": 15}
+_PROFILE_SPEEDS = {"bike": 16.0, "foot": 5.0}
+_NO_BIKE = {"motorway", "motorway_link", "trunk", "trunk_link", "steps", "footway", "pedestrian"}
+_NO_FOOT = {"motorway", "motorway_link", "trunk", "trunk_link", "cycleway"}
+_ONEWAY_CLASSES = {"motorway", "motorway_link"}
+
+
+def _haversine(lat1, lon1, lat2, lon2) -> float:
+    p1 = math.radians(lat1); p2 = math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * _EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell_key(lat: float, lon: float) -> int:
+    return (math.floor(lat / _GRID_DEG) + 9000) * 40000 + math.floor(lon / _GRID_DEG) + 20000
+
+
+def _profile_speeds(profile: str) -> list:
+    if profile == "car":
+        return [_CAR_SPEEDS.get(c, 0) / 3.6 for c in _HIGHWAY_CLASSES]
+    return [_PROFILE_SPEEDS[profile] / 3.6] * len(_HIGHWAY_CLASSES)
+
+
+def _way_access(tags: dict):
+    cls = tags.get("highway")
+    if cls not in _HIGHWAY_CLASSES:
+        return None
+    bits = (1 if cls in _CAR_SPEEDS else 0) | (0 if cls in _NO_BIKE else 2) | (0 if cls in _NO_FOOT else 4)
+    if tags.get("access") in ("no", "private"):
+        bits = 0
+    for key, bit in (("motor_vehicle", 1), ("motorcar", 1), ("bicycle", 2), ("foot", 4)):
+        v = tags.get(key)
+        if v in ("no", "private", "use_sidepath"):
+            bits &= ~bit
+        elif v in ("yes", "designated", "permissive"):
+            bits |= bit
+    if not bits:
+        return None
+    oneway = tags.get("oneway")
+    if oneway is None and (cls in _ONEWAY_CLASSES or tags.get("junction") == "roundabout"):
+        oneway = "yes"
+    one_bits = (bits & 1) | (0 if tags.get("oneway:bicycle") == "no" else bits & 2)
+    fwd, bwd = bits, bits
+    if oneway in ("yes", "true", "1"):
+        bwd = bits & ~one_bits
+    elif oneway == "-1":
+        fwd = bits & ~one_bits
+    return _HIGHWAY_CLASSES.index(cls), fwd, bwd
+
+
+def _open_osm(path: str):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_osm(path: str, tag: str):
+    with _open_osm(path) as f:
+        context = ElementTree.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "end" and elem.tag in ("node", "way", "relation"):
+                if elem.tag == tag:
+                    yield elem
+                root.clear()
+
+
+def _import_osm(src: str, dst: str):
+    ways = []
+    used = set()
+    for elem in _iter_osm(src, "way"):
+        tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+        access = _way_access(tags)
+        if access is None:
+            continue
+        refs = array("q", (int(nd.get("ref")) for nd in elem.iter("nd")))
+        if len(refs) < 2:
+            continue
+        ways.append((refs, access))
+        used.update(refs)
+    coords = {}
+    for elem in _iter_osm(src, "node"):
+        nid = int(elem.get("id"))
+        lat, lon = elem.get("lat"), elem.get("lon")
+        if nid in used and lat is not None and lon is not None:
+            coords[nid] = (float(lat), float(lon))
+    order = sorted(coords, key=lambda nid: (_cell_key(*coords[nid]), nid))
+    index = {nid: i for i, nid in enumerate(order)}
+    n = len(order)
+    lat = array("f", (coords[nid][0] for nid in order))
+    lon = array("f", (coords[nid][1] for nid in order))
+    src_ids = array("I"); dst_ids = array("I"); lengths = array("f"); classes = array("B"); masks = array("B")
+    for refs, (cls, fwd, bwd) in ways:
+        for a, b in zip(refs, refs[1:]):
+            if a not in index or b not in index or a == b:
+                continue
+            u, v = index[a], index[b]
+            d = _haversine(lat[u], lon[u], lat[v], lon[v])
+            for s, t, bits in ((u, v, fwd), (v, u, bwd)):
+                if bits:
+                    src_ids.append(s); dst_ids.append(t); lengths.append(d); classes.append(cls); masks.append(bits)
+    m = len(src_ids)
+    offsets = array("I", bytes(4 * (n + 1)))
+    for s in src_ids:
+        offsets[s + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    fill = array("I", offsets[:n])
+    perm = array("I", bytes(4 * m))
+    for e, s in enumerate(src_ids):
+        perm[fill[s]] = e
+        fill[s] += 1
+    cell_keys = array("q"); cell_starts = array("I")
+    for i in range(n):
+        key = _cell_key(lat[i], lon[i])
+        if not cell_keys or cell_keys[-1] != key:
+            cell_keys.append(key); cell_starts.append(i)
+    cell_starts.append(n)
+    sections = [lat, lon, offsets, array("I", (dst_ids[e] for e in perm)), array("f", (lengths[e] for e in perm)),
+                array("B", (classes[e] for e in perm)), array("B", (masks[e] for e in perm)), cell_keys, cell_starts]
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_GRAPH_HEADER.pack(_GRAPH_MAGIC, n, m, len(cell_keys)))
+        for arr in sections:
+            raw = arr.tobytes()
+            f.write(raw)
+            f.write(bytes(-len(raw) % 8))
+    os.replace(tmp, dst)
+
+
+class _RoadGraph:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, m, c = _GRAPH_HEADER.unpack_from(self._mm, 0)
+        if magic != _GRAPH_MAGIC:
+            raise ValueError("Not a road graph file")
+        view = memoryview(self._mm)
+        pos = _GRAPH_HEADER.size
+        out = []
+        for code, count in (("f", n), ("f", n), ("I", n + 1), ("I", m), ("f", m), ("B", m), ("B", m), ("q", c), ("I", c + 1)):
+            size = struct.calcsize(code) * count
+            out.append(view[pos:pos + size].cast(code))
+            pos += size + (-size % 8)
+        self.lat, self.lon, self.offsets, self.targets, self.lengths, self.classes, self.masks, self.cell_keys, self.cell_starts = out
+        self.nodes, self.edges = n, m
+        self.present = set(self.classes.tobytes())
+        k = math.radians(_EARTH_RADIUS)
+        kx = k * math.cos(math.radians(max((abs(v) for v in self.lat), default=0.0)))
+        self.xm = array("f", (v * kx for v in self.lon))
+        self.ym = array("f", (v * k for v in self.lat))
+
+    def cell_range(self, lat0, lon0, lat1, lon1):
+        for row in range(math.floor(lat0 / _GRID_DEG), math.floor(lat1 / _GRID_DEG) + 1):
+            lo = _cell_key(row * _GRID_DEG + _GRID_DEG / 2, lon0)
+            hi = _cell_key(row * _GRID_DEG + _GRID_DEG / 2, lon1)
+            c = bisect.bisect_left(self.cell_keys, lo)
+            while c < len(self.cell_keys) and self.cell_keys[c] <= hi:
+                yield self.cell_starts[c], self.cell_starts[c + 1]
+                c += 1
+
+    def snap(self, lat: float, lon: float, bit: int):
+        r = _SNAP_CELLS * _GRID_DEG
+        best, best_d = None, None
+        for start, end in self.cell_range(lat - r, lon - r, lat + r, lon + r):
+            for i in range(start, end):
+                if not any(self.masks[e] & bit for e in range(self.offsets[i], self.offsets[i + 1])):
+                    continue
+                d = _haversine(lat, lon, self.lat[i], self.lon[i])
+                if best_d is None or d < best_d:
+                    best, best_d = i, d
+        return best
+
+    def route(self, src: int, dst: int, profile: str):
+        bit = _PROFILE_BITS[profile]
+        speeds = _profile_speeds(profile)
+        inv_vmax = 0.999 / max(speeds[c] for c in self.present)
+        xm, ym, offsets, targets, lengths, classes, masks = self.xm, self.ym, self.offsets, self.targets, self.lengths, self.classes, self.masks
+        tx, ty = xm[dst], ym[dst]
+        hypot = math.hypot
+        g = {src: 0.0}
+        prev = {}
+        heap = [(hypot(xm[src] - tx, ym[src] - ty) * inv_vmax, 0.0, src)]
+        while heap:
+            _, gu, u = heapq.heappop(heap)
+            if u == dst:
+                break
+            if gu > g[u]:
+                continue
+            for e in range(offsets[u], offsets[u + 1]):
+                if not masks[e] & bit:
+                    continue
+                speed = speeds[classes[e]]
+                if not speed:
+                    continue
+                v = targets[e]
+                gv = gu + lengths[e] / speed
+                if gv < g.get(v, math.inf):
+                    g[v] = gv
+                    prev[v] = (u, e)
+                    heapq.heappush(heap, (gv + hypot(xm[v] - tx, ym[v] - ty) * inv_vmax, gv, v))
+        if dst not in g:
+            return None
+        path = [dst]
+        meters = 0.0
+        while path[-1] != src:
+            u, e = prev[path[-1]]
+            meters += lengths[e]
+            path.append(u)
+        path.reverse()
+        return path, meters, g[dst]
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _graphs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="newelle-route")
+        return _executor
+
+
+def _get_graph(osm_path: str) -> _RoadGraph:
+    st = os.stat(osm_path)
+    digest = hashlib.sha1(f"{os.path.abspath(osm_path)}|{st.st_mtime_ns}|{st.st_size}".encode("utf-8")).hexdigest()
+    with _graphs_lock:
+        graph = _graphs.get(digest)
+    if graph is not None:
+        return graph
+    graph_path = os.path.join(GLib.get_user_cache_dir(), "newelle", "route", digest + ".graph")
+    if not os.path.isfile(graph_path):
+        _import_osm(osm_path, graph_path)
+    graph = _RoadGraph(graph_path)
+    with _graphs_lock:
+        _graphs[digest] = graph
+    return graph
+
+
+def _solve_route(graph: _RoadGraph, points: list, profile: str):
+    bit = _PROFILE_BITS[profile]
+    nodes = []
+    for lat, lon in points:
+        i = graph.snap(lat, lon, bit)
+        if i is None:
+            raise RuntimeError(f"No {profile} road near {lat:.5f}, {lon:.5f}")
+        nodes.append(i)
+    path, meters, seconds = [nodes[0]], 0.0, 0.0
+    for a, b in zip(nodes, nodes[1:]):
+        if a == b:
+            continue
+        leg = graph.route(a, b, profile)
+        if leg is None:
+            raise RuntimeError(f"No {profile} route between the given points")
+        path.extend(leg[0][1:])
+        meters += leg[1]
+        seconds += leg[2]
+    return path, meters, seconds
+
+
+class _RouteView:
+    def __init__(self, graph: _RoadGraph, path: list, points: list):
+        self.graph = graph
+        self.path = path
+        self.points = points
+        self.area = Gtk.DrawingArea(hexpand=True)
+        self.area.set_content_height(_ROUTE_VIEW_HEIGHT)
+        self.area.set_draw_func(self._draw)
+        lats = [graph.lat[i] for i in path] + [p[0] for p in points]
+        lons = [graph.lon[i] for i in path] + [p[1] for p in points]
+        self.bounds = (min(lats), min(lons), max(lats), max(lons))
+        self.kx = math.cos(math.radians((self.bounds[0] + self.bounds[2]) / 2))
+
+    def _draw(self, _a, cr, w, h):
+        lat0, lon0, lat1, lon1 = self.bounds
+        pad = 16
+        span_x = max((lon1 - lon0) * self.kx, 1e-6); span_y = max(lat1 - lat0, 1e-6)
+        s = min((w - 2 * pad) / span_x, (h - 2 * pad) / span_y)
+        ox = (w - span_x * s) / 2; oy = (h - span_y * s) / 2
+        def xy(lat, lon):
+            return ox + (lon - lon0) * self.kx * s, h - oy - (lat - lat0) * s
+        g = self.graph
+        cr.set_source_rgb(0.95, 0.95, 0.93)
+        cr.paint()
+        mlat = (h / 2) / s; mlon = (w / 2) / s / max(self.kx, 1e-6)
+        cr.set_source_rgba(0.5, 0.5, 0.5, 0.5)
+        cr.set_line_width(1)
+        drawn = 0
+        for start, end in g.cell_range(lat0 - mlat, lon0 - mlon, lat1 + mlat, lon1 + mlon):
+            for u in range(start, end):
+                for e in range(g.offsets[u], g.offsets[u + 1]):
+                    v = g.targets[e]
+                    if v < u:
+                        continue
+                    cr.move_to(*xy(g.lat[u], g.lon[u]))
+                    cr.line_to(*xy(g.lat[v], g.lon[v]))
+                    drawn += 1
+            if drawn > _CONTEXT_EDGES:
+                break
+        cr.stroke()
+        cr.set_source_rgb(0.2, 0.4, 0.85)
+        cr.set_line_width(4)
+        cr.set_line_join(cairo.LINE_JOIN_ROUND)
+        for k, i in enumerate(self.path):
+            (cr.line_to if k else cr.move_to)(*xy(g.lat[i], g.lon[i]))
+        cr.stroke()
+        for k, (lat, lon) in enumerate(self.points):
+            x, y = xy(lat, lon)
+            cr.arc(x, y, 6, 0, 2 * math.pi)
+            if k == 0:
+                cr.set_source_rgb(0.2, 0.65, 0.3)
+            elif k == len(self.points) - 1:
+                cr.set_source_rgb(0.86, 0.2, 0.18)
+            else:
+                cr.set_source_rgb(0.95, 0.6, 0.1)
+            cr.fill_preserve()
+            cr.set_source_rgb(1, 1, 1)
+            cr.set_line_width(2)
+            cr.stroke()
+
+
+class _TabPool:
+    def __init__(self):
+        self._tabs = OrderedDict()
+
+    def open(self, ui_controller, url: str, cap: int):
+        cap = max(1, cap)
+        for tab in [t for t in self._tabs if not self._alive(t)]:
+            del self._tabs[tab]
+        for tab, shown in self._tabs.items():
+            if shown == url:
+                self._tabs.move_to_end(tab)
+                self._select(tab)
+                return tab
+        while len(self._tabs) > cap:
+            self._close(self._tabs.popitem(last=False)[0])
+        if len(self._tabs) >= cap:
+            tab = next(iter(self._tabs))
+            if self._navigate(tab, url):
+                self._tabs[tab] = url
+                self._tabs.move_to_end(tab)
+                self._select(tab)
+                return tab
+            self._tabs.pop(tab)
+            self._close(tab)
+        tab = ui_controller.new_browser_tab(url, new=True)
+        if tab is not None:
+            self._tabs[tab] = url
+        return tab
+
+    def _alive(self, tab) -> bool:
+        child = tab.get_child()
+        return child is not None and child.get_root() is not None
+
+    def _navigate(self, tab, url: str) -> bool:
+        child = tab.get_child()
+        if hasattr(child, "navigate_to"):
+            child.navigate_to(url)
+            return True
+        webview = getattr(child, "webview", None)
+        if webview is not None:
+            webview.load_uri(url)
+            return True
+        return False
+
+    def _select(self, tab):
+        view = tab.get_child().get_ancestor(Adw.TabView)
+        if view is not None:
+            view.set_selected_page(tab)
+
+    def _close(self, tab):
+        child = tab.get_child()
+        view = child.get_ancestor(Adw.TabView) if child is not None else None
+        if view is not None:
+            view.close_page(tab)
+
+
+_tab_pool = _TabPool()
+
 
 class GraphHopperRouteExtension(NewelleExtension):
     id = "graphhopper_route"
     name = "GraphHopper Route"
 
+    def get_extra_settings(self) -> list:
+        return [
+            {
+                "key": "route_osm",
+                "title": "Offline road data",
+                "description": "Path to a local OpenStreetMap extract (.osm, .osm.gz or .osm.bz2) used to compute routes in the app",
+                "type": "entry",
+                "default": "",
+            },
+            {
+                "key": "route_tab_limit",
+                "title": "Browser tabs",
+                "description": "How many route tabs to keep open; further links reuse the least recently used one",
+                "type": "combo",
+                "values": ["1", "2", "4", "8"],
+                "default": "2",
+            },
+        ]
+
     def get_replace_codeblocks_langs(self) -> list:
         return ["route"]
 
@@ -15,7 +439,7 @@ class GraphHopperRouteExtension(NewelleExtension):
                 "key": "route",
                 "setting_name": "route",
                 "title": "Route Codeblocks",
-                "description": "Show multi-point routes via GraphHopper",
+                "description": "Show multi-point routes via GraphHopper or an offline road graph",
                 "editable": True,
                 "show_in_settings": True,
                 "default": True,
@@ -35,12 +459,54 @@ class GraphHopperRouteExtension(NewelleExtension):
         b.set_tooltip_text("Open Route")
         b.set_child(Gtk.Image.new_from_icon_name("go-next-symbolic"))
         b.connect("clicked", lambda _b: self._open_route_tab(points, profile))
-        return b
+        osm_path = os.path.expanduser(self.get_setting("route_osm") or "")
+        if not osm_path or profile not in _PROFILE_BITS:
+            return b
+        return self._build_offline_route(osm_path, points, profile, b)
+
+    def _build_offline_route(self, osm_path: str, points: list, profile: str, button: Gtk.Button):
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6, hexpand=True)
+        overlay = Gtk.Overlay(hexpand=True)
+        box.append(overlay)
+        status = Gtk.Label(label="Computing route…", xalign=0)
+        status.add_css_class("dim-label")
+        box.append(status)
+        button.set_halign(Gtk.Align.END)
+        button.set_valign(Gtk.Align.START)
+        button.set_margin_top(8)
+        button.set_margin_end(8)
+        placeholder = Gtk.Box(height_request=_ROUTE_VIEW_HEIGHT, hexpand=True)
+        overlay.set_child(placeholder)
+        overlay.add_overlay(button)
+        def done(result, error):
+            if error is not None:
+                status.set_text(f"Offline route unavailable: {error}")
+                return False
+            graph, path, meters, seconds, elapsed = result
+            overlay.set_child(_RouteView(graph, path, points).area)
+            status.set_text(f"{meters / 1000:.1f} km · {self._format_duration(seconds)} · {profile} · {elapsed * 1000:.0f} ms")
+            return False
+        def solve():
+            try:
+                graph = _get_graph(osm_path)
+                t0 = time.perf_counter()
+                path, meters, seconds = _solve_route(graph, points, profile)
+                GLib.idle_add(done, (graph, path, meters, seconds, time.perf_counter() - t0), None)
+            except Exception as e:
+                GLib.idle_add(done, None, e)
+        _get_executor().submit(solve)
+        return box
+
+    def _format_duration(self, seconds: float) -> str:
+        minutes = int(round(seconds / 60))
+        if minutes < 60:
+            return f"{max(1, minutes)} min"
+        return f"{minutes // 60} h {minutes % 60:02d} min"
 
     def _open_route_tab(self, points, profile):
         qs = "&".join([f"point={lat:.6f},{lon:.6f}" for lat, lon in points])
         url = f"https://graphhopper.com/maps/?{qs}&profile={profile}&locale=ru"
-        tab = self.ui_controller.new_browser_tab(url, new=True)
+        tab = _tab_pool.open(self.ui_controller, url, int(self.get_setting("route_tab_limit") or 2))
         if tab is not None:
             tab.set_title(f"{profile} · {len(points)} pts")
             tab.set_icon(Gio.ThemedIcon.new("mark-location-symbolic"))
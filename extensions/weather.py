@@ -1,7 +1,1075 @@
 from .extensions import NewelleExtension
-from gi.repository import Gtk, Gio, GLib
-import urllib.request, urllib.parse, json, threading, math
-from datetime import datetime
+from gi.repository import Gtk, Gio, GLib, GObject
+import cairo
+import urllib.parse, json, threading, math, os, time, hashlib, bisect, gzip, http.client, heapq, itertools, functools, socket
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, date
+
+_MODEL_UPDATE_SECS = 3600
+_GEOCODE_TTL_SECS = 30 * 24 * 3600
+_DISK_TRIM_RATIO = 0.9
+_GAZETTEER_MIN_PREFIX = 3
+_FETCH_WORKERS = 8
+_HOST_CONCURRENCY = 4
+_CONNECT_TIMEOUT = 5.0
+_READ_TIMEOUT = 20.0
+_RATE_PER_SEC = 5.0
+_RATE_BURST = 10
+_HEDGE_MIN_SAMPLES = 20
+_HEDGE_MIN_DELAY = 0.25
+_BATCH_MAX_LOCATIONS = 50
+_FORECAST_PAST_DAYS = 92
+_FORECAST_MAX_DAYS = 16
+_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+_ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+_GEOCODE_URL = "https://geocoding-api.open-meteo.com/v1/search"
+_REFRESH_RETRY_SECS = 300
+_SPARKLINE_MAX_POINTS = 240
+_VIRTUAL_THRESHOLD = 12
+_VIRTUAL_HEIGHT = 520
+_IMPERIAL_CONVERSIONS = {
+    "temperature_2m": lambda c: c * 9.0 / 5.0 + 32.0,
+    "apparent_temperature": lambda c: c * 9.0 / 5.0 + 32.0,
+    "precipitation": lambda mm: mm / 25.4,
+    "windspeed_10m": lambda kmh: kmh / 1.609344,
+}
+_HOURLY_VARS = ["temperature_2m","apparent_temperature","weathercode","relativehumidity_2m","precipitation_probability","precipitation","windspeed_10m"]
+
+_WEATHER_CSS = b"""
+.wx-card {
+    border-radius: 16px;
+    padding: 14px;
+    box-shadow: 0 10px 28px alpha(@theme_fg_color, 0.18);
+}
+.wx-sun { background-image: linear-gradient(135deg, #FFCF6F, #FF7E5F); color: #232323; }
+.wx-cloud { background-image: linear-gradient(135deg, #B0BEC5, #90A4AE); color: #101417; }
+.wx-rain { background-image: linear-gradient(135deg, #74ABE2, #5563DE); color: #0e1221; }
+.wx-snow { background-image: linear-gradient(135deg, #E0F7FA, #B3E5FC); color: #143a4a; }
+.wx-storm { background-image: linear-gradient(135deg, #7F7FD5, #86A8E7); color: #0f1330; }
+.wx-night { background-image: linear-gradient(135deg, #1E3C72, #2A5298); color: #E8F1FF; }
+
+.wx-title { font-weight: 800; font-size: 14px; letter-spacing: .2px; }
+.wx-temp { font-size: 38px; font-weight: 900; }
+.wx-subtle { opacity: .9; }
+.wx-row { padding-top: 6px; }
+
+.wx-chip {
+    background-color: alpha(@theme_bg_color, 0.18);
+    border-radius: 999px;
+    padding: 4px 8px;
+    font-weight: 600;
+}
+.wx-chip-box { border-spacing: 8px; }
+
+.wx-cta {
+    border-radius: 999px;
+    padding: 8px 14px;
+    background-image: linear-gradient(135deg, #FF7E5F, #F83E6D);
+    color: white;
+    border: none;
+    box-shadow: 0 6px 18px rgba(248, 62, 109, 0.35);
+}
+.wx-cta:hover { filter: brightness(1.06); }
+.wx-cta label { color: white; font-weight: 800; }
+
+.wx-table { border-radius: 16px; padding: 14px; background: alpha(@theme_fg_color, 0.05); }
+.wx-head { font-weight: 700; opacity: .8; }
+.wx-cell { border-radius: 999px; padding: 2px 8px; background-color: alpha(@theme_fg_color, 0.06); font-weight: 600; }
+
+.wx-list { background: transparent; }
+.wx-list > row { padding: 5px 0; }
+"""
+
+
+class _CacheStore:
+    def __init__(self, directory: str | None, max_bytes: int = 8 * 1024 * 1024, max_disk_bytes: int = 64 * 1024 * 1024, codec=None):
+        self.directory = directory
+        self.codec = codec
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        data, expires = self.get_entry(key)
+        if data is not None and (expires is None or expires > time.time()):
+            return data
+        return None
+
+    def get_entry(self, key: str):
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                expires, size, data = item
+                self._mem.move_to_end(key)
+                self._count(expires, now)
+                return data, expires
+        rec = self._read_disk(key)
+        if rec is not None:
+            data = rec.get("data")
+            expires = rec.get("expires")
+            size = rec.get("size") or 0
+            if self.codec is not None and data is not None:
+                data = self.codec.from_payload(data)
+                size = data.nbytes()
+            with self._lock:
+                self._count(expires, now)
+                self.disk_hits += 1
+                self._store(key, data, expires, size)
+            return data, expires
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def peek_expiry(self, key: str) -> float | None:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                return item[0]
+        rec = self._read_disk(key)
+        return rec.get("expires") if rec is not None else None
+
+    def put(self, key: str, data, expires: float | None):
+        payload = data.to_payload() if self.codec is not None else data
+        raw = json.dumps({"key": key, "expires": expires, "data": payload}, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._store(key, data, expires, data.nbytes() if self.codec is not None else len(raw))
+        self._write_disk(key, raw)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {"hits": self.hits, "stale_hits": self.stale_hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": (self.hits / total) if total else 0.0, "entries": len(self._mem), "bytes": self._mem_bytes}
+
+    def _count(self, expires, now):
+        if expires is None or expires > now:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+
+    def _store(self, key, data, expires, size):
+        if key in self._mem:
+            self._drop(key)
+        self._mem[key] = (expires, size, data)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_bytes and len(self._mem) > 1:
+            old = next(iter(self._mem))
+            self._drop(old)
+            self.evictions += 1
+
+    def _drop(self, key):
+        item = self._mem.pop(key, None)
+        if item is not None:
+            self._mem_bytes -= item[1]
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            rec = json.loads(raw.decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+        if rec.get("key") != key:
+            return None
+        rec["size"] = len(raw)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return rec
+
+    def _write_disk(self, key, raw):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            try:
+                old = os.path.getsize(path)
+            except OSError:
+                old = 0
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(raw)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._trim_disk(len(raw) - old)
+
+    def _trim_disk(self, added: int):
+        with self._disk_lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += added
+                if self._disk_bytes <= self.max_disk_bytes:
+                    return
+            try:
+                files = []
+                for fn in os.listdir(self.directory):
+                    if fn.endswith(".json"):
+                        st = os.stat(os.path.join(self.directory, fn))
+                        files.append((st.st_mtime, st.st_size, fn))
+            except OSError:
+                return
+            total = sum(f[1] for f in files)
+            if total > self.max_disk_bytes:
+                files.sort()
+                for mtime, size, fn in files:
+                    if total <= self.max_disk_bytes * _DISK_TRIM_RATIO:
+                        break
+                    try:
+                        os.remove(os.path.join(self.directory, fn))
+                        total -= size
+                    except OSError:
+                        pass
+            self._disk_bytes = total
+
+
+class _Metrics:
+    def __init__(self, samples: int = 1024):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counts = {}
+        self._errors = {}
+
+    def record(self, name: str, seconds: float, error: bool = False):
+        with self._lock:
+            spans = self._spans.get(name)
+            if spans is None:
+                spans = deque(maxlen=self.samples)
+                self._spans[name] = spans
+            spans.append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def span(self, name: str):
+        return _Span(self, name)
+
+    def percentile(self, name: str, p: float, min_count: int = 1) -> float | None:
+        with self._lock:
+            vals = self._spans.get(name)
+            if vals is None or len(vals) < min_count:
+                return None
+            vals = sorted(vals)
+        return vals[min(len(vals) - 1, int(math.ceil(p * len(vals))) - 1)]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            spans = {k: sorted(v) for k, v in self._spans.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        out = {}
+        for name, vals in spans.items():
+            def pct(p):
+                return round(vals[min(len(vals) - 1, int(math.ceil(p * len(vals))) - 1)] * 1000, 3) if vals else None
+            out[name] = {"count": counts.get(name, 0), "errors": errors.get(name, 0), "p50_ms": pct(0.50), "p95_ms": pct(0.95),
+                         "p99_ms": pct(0.99), "max_ms": round(vals[-1] * 1000, 3) if vals else None}
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counts.clear()
+            self._errors.clear()
+
+
+class _Span:
+    def __init__(self, metrics: _Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.t0, exc_type is not None)
+        return False
+
+
+# Phases: "block" and "table" wrap a whole codeblock load; inside them "geocode", "forecast",
+# "http" and "json_decode" time the fetches, "hour_select" and "fill" the per-card work.
+_metrics = _Metrics()
+
+
+def _timed(name: str):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with _metrics.span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def _next_model_update(now: float | None = None) -> float:
+    now = time.time() if now is None else now
+    return (int(now) // _MODEL_UPDATE_SECS + 1) * _MODEL_UPDATE_SECS
+
+
+class _ForecastSeries:
+    __slots__ = ("timezone", "current_time", "hours", "columns", "_imperial")
+
+    def __init__(self, timezone: str = "", current_time: str | None = None, hours: array | None = None, columns: dict | None = None):
+        self.timezone = timezone
+        self.current_time = current_time
+        self.hours = hours if hours is not None else array("l")
+        self.columns = columns if columns is not None else {}
+        self._imperial = None
+
+    @classmethod
+    def from_payload(cls, data):
+        if isinstance(data, cls):
+            return data
+        hourly = data.get("hourly") or {}
+        times = hourly.get("time") or []
+        hours = array("l")
+        prev = 0
+        for iso in times:
+            try:
+                prev = _iso_to_hours(iso)
+            except (TypeError, ValueError):
+                pass
+            hours.append(prev)
+        n = len(hours)
+        columns = {}
+        for k, col in hourly.items():
+            if k == "time" or not isinstance(col, list):
+                continue
+            packed = array("f", [math.nan if v is None else v for v in col[:n]])
+            if len(packed) < n:
+                packed.extend([math.nan] * (n - len(packed)))
+            columns[k] = packed
+        return cls(data.get("timezone") or "", (data.get("current_weather") or {}).get("time"), hours, columns)
+
+    def to_payload(self) -> dict:
+        hourly = {"time": [self.time_iso(i) for i in range(len(self.hours))]}
+        for k, col in self.columns.items():
+            hourly[k] = [None if v != v else round(v, 3) for v in col]
+        out = {"timezone": self.timezone, "hourly": hourly}
+        if self.current_time:
+            out["current_weather"] = {"time": self.current_time}
+        return out
+
+    def __len__(self):
+        return len(self.hours)
+
+    def time_iso(self, i: int) -> str:
+        h = self.hours[i]
+        return f"{date.fromordinal(h // 24).isoformat()}T{h % 24:02d}:00"
+
+    def column(self, name: str, units: str = "metric"):
+        if units == "imperial" and name in _IMPERIAL_CONVERSIONS:
+            if self._imperial is None:
+                self._imperial = {}
+            col = self._imperial.get(name)
+            if col is None:
+                fn = _IMPERIAL_CONVERSIONS[name]
+                col = array("f", [fn(v) for v in self.columns.get(name, ())])
+                self._imperial[name] = col
+            return col
+        return self.columns.get(name) or array("f")
+
+    def value(self, name: str, i: int, units: str = "metric"):
+        col = self.column(name, units)
+        if not 0 <= i < len(col):
+            return None
+        v = col[i]
+        return None if v != v else v
+
+    def values(self, name: str, i0: int, i1: int, units: str = "metric") -> list:
+        return [None if v != v else v for v in self.column(name, units)[i0:i1]]
+
+    def nbytes(self) -> int:
+        size = self.hours.itemsize * len(self.hours)
+        for col in self.columns.values():
+            size += col.itemsize * len(col)
+        return size + 64 * (len(self.columns) + 1)
+
+    def split_days(self) -> dict:
+        out = OrderedDict()
+        start = 0
+        for i in range(1, len(self.hours) + 1):
+            if i == len(self.hours) or self.hours[i] // 24 != self.hours[start] // 24:
+                day = date.fromordinal(self.hours[start] // 24).isoformat()
+                out[day] = _ForecastSeries(self.timezone, None, self.hours[start:i], {k: col[start:i] for k, col in self.columns.items()})
+                start = i
+        return out
+
+    @classmethod
+    def concat(cls, parts: list):
+        out = cls()
+        for part in parts:
+            out.timezone = part.timezone or out.timezone
+            n = len(out.hours)
+            for k, col in part.columns.items():
+                dst = out.columns.get(k)
+                if dst is None:
+                    dst = out.columns[k] = array("f", [math.nan] * n)
+                dst.extend(col)
+            out.hours.extend(part.hours)
+            for dst in out.columns.values():
+                if len(dst) < len(out.hours):
+                    dst.extend([math.nan] * (len(out.hours) - len(dst)))
+        return out
+
+
+class _WeatherEntry:
+    __slots__ = ("name", "lat", "lon", "timezone", "iso_time", "local_time_str", "weathercode", "is_night", "temperature",
+                 "apparent_temperature", "humidity", "precip_prob", "precip", "windspeed",
+                 "temp_min", "temp_max", "precip_total", "hours", "series", "precip_series")
+
+    def __init__(self, **fields):
+        for k in self.__slots__:
+            setattr(self, k, fields.get(k))
+
+
+def _iso_to_hours(s: str) -> int:
+    y = int(s[0:4]); m = int(s[5:7]); d = int(s[8:10]); h = int(s[11:13]) if len(s) >= 13 else 0
+    return date(y, m, d).toordinal() * 24 + h
+
+
+_CACHE_CODECS = {"forecast": _ForecastSeries, "archive": _ForecastSeries}
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(name: str) -> _CacheStore:
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _CacheStore(os.path.join(GLib.get_user_cache_dir(), "newelle", "weather", name), codec=_CACHE_CODECS.get(name))
+            _caches[name] = cache
+        return cache
+
+
+def _normalize_place(s: str) -> str:
+    return " ".join((s or "").casefold().split())
+
+
+class _Gazetteer:
+    def __init__(self, path: str):
+        self.path = path
+        rows = []
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 9:
+                    continue
+                try:
+                    lat = float(cols[4]); lon = float(cols[5])
+                except ValueError:
+                    continue
+                try:
+                    pop = int(cols[14]) if len(cols) > 14 and cols[14] else 0
+                except ValueError:
+                    pop = 0
+                names = {cols[1], cols[2]}
+                if cols[3]:
+                    names.update(cols[3].split(","))
+                rows.append((cols[1], cols[8], lat, lon, pop, names))
+        self.display = [r[0] for r in rows]
+        self.country = [r[1] for r in rows]
+        self.lat = array("d", (r[2] for r in rows))
+        self.lon = array("d", (r[3] for r in rows))
+        self.population = array("q", (r[4] for r in rows))
+        pairs = sorted({(_normalize_place(n), i) for i, r in enumerate(rows) for n in r[5] if n})
+        self.keys = [k for k, _ in pairs]
+        self.ids = array("l", (i for _, i in pairs))
+
+    def __len__(self):
+        return len(self.display)
+
+    def complete(self, prefix: str, limit: int = 10, country: str | None = None) -> list:
+        p = _normalize_place(prefix)
+        lo = bisect.bisect_left(self.keys, p)
+        out = []
+        seen = set()
+        for j in range(lo, len(self.keys)):
+            if not self.keys[j].startswith(p):
+                break
+            i = self.ids[j]
+            if i not in seen and (country is None or self.country[i] == country):
+                seen.add(i)
+                out.append(i)
+        out.sort(key=lambda i: -self.population[i])
+        return out[:limit]
+
+    def lookup(self, query: str):
+        parts = [p.strip() for p in query.split(",")]
+        name = _normalize_place(parts[0])
+        cc = parts[-1].upper() if len(parts) > 1 and len(parts[-1]) == 2 else None
+        lo = bisect.bisect_left(self.keys, name)
+        hi = bisect.bisect_right(self.keys, name, lo)
+        best = None
+        for j in range(lo, hi):
+            i = self.ids[j]
+            if cc and self.country[i] != cc:
+                continue
+            if best is None or self.population[i] > self.population[best]:
+                best = i
+        if best is None:
+            return None
+        cc = self.country[best]
+        return self.lat[best], self.lon[best], self.display[best] + (f" ({cc})" if cc else "")
+
+
+_gazetteers = {}
+_gazetteers_lock = threading.Lock()
+
+
+def _get_gazetteer(path: str) -> _Gazetteer | None:
+    if not path:
+        return None
+    with _gazetteers_lock:
+        if path not in _gazetteers:
+            try:
+                _gazetteers[path] = _Gazetteer(path)
+            except OSError:
+                _gazetteers[path] = None
+        return _gazetteers[path]
+
+
+class _SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def claim(self, key):
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.shared += 1
+                return fut, False
+            fut = Future()
+            self._inflight[key] = fut
+            self.leaders += 1
+            return fut, True
+
+    def resolve(self, key, result=None, error: BaseException | None = None):
+        with self._lock:
+            fut = self._inflight.pop(key, None)
+        if fut is None:
+            return
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    def do(self, key, fn):
+        fut, owner = self.claim(key)
+        if not owner:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, error=e)
+            raise
+        self.resolve(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "saved_calls": self.shared, "in_flight": len(self._inflight)}
+
+
+class _HttpClient:
+    def __init__(self, connect_timeout: float = _CONNECT_TIMEOUT, read_timeout: float = _READ_TIMEOUT, max_idle_per_host: int = _HOST_CONCURRENCY,
+                 retries: int = 1, max_validators: int = 128, user_agent: str = "Newelle-Weather/1.0"):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.retries = retries
+        self.max_validators = max_validators
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._validators = OrderedDict()
+        self.timings = deque(maxlen=256)
+
+    def get(self, url: str, box: dict | None = None) -> bytes:
+        parts = urllib.parse.urlsplit(url)
+        origin = (parts.scheme, parts.netloc)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {"User-Agent": self.user_agent, "Accept": "application/json", "Accept-Encoding": "gzip"}
+        with self._lock:
+            validator = self._validators.get(url)
+        if validator is not None:
+            if validator[0]:
+                headers["If-None-Match"] = validator[0]
+            if validator[1]:
+                headers["If-Modified-Since"] = validator[1]
+        attempt = 0
+        while True:
+            conn = resp = None
+            reused = False
+            t0 = time.perf_counter()
+            try:
+                conn, reused = self._acquire(origin, fresh=attempt > 0)
+                if box is not None:
+                    box["conn"] = conn
+                    if box["aborted"]:
+                        raise ConnectionAbortedError("superseded by hedged request")
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                if conn is not None:
+                    conn.close()
+                stale = reused and resp is None and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError))
+                if stale and attempt < self.retries and not (box and box["aborted"]):
+                    attempt += 1
+                    continue
+                raise
+            elapsed = time.perf_counter() - t0
+            if resp.will_close or (box and box["aborted"]):
+                conn.close()
+            else:
+                self._release(origin, conn)
+            break
+        self.timings.append({"host": parts.netloc, "path": parts.path, "status": resp.status, "seconds": elapsed,
+                             "bytes": len(body), "reused": reused, "attempts": attempt + 1})
+        if resp.status == 304 and validator is not None:
+            return validator[2]
+        if resp.getheader("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        if resp.status >= 400:
+            reason = resp.reason
+            try:
+                reason = json.loads(body.decode("utf-8")).get("reason") or reason
+            except Exception:
+                pass
+            raise RuntimeError(f"HTTP {resp.status}: {reason}")
+        etag = resp.getheader("ETag")
+        modified = resp.getheader("Last-Modified")
+        if etag or modified:
+            with self._lock:
+                self._validators[url] = (etag, modified, body)
+                self._validators.move_to_end(url)
+                while len(self._validators) > self.max_validators:
+                    self._validators.popitem(last=False)
+        return body
+
+    def _acquire(self, origin, fresh: bool = False):
+        with self._lock:
+            conns = self._idle.get(origin)
+            if conns and not fresh:
+                return conns.pop(), True
+        scheme, netloc = origin
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = cls(netloc, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn, False
+
+    def _release(self, origin, conn):
+        with self._lock:
+            conns = self._idle.setdefault(origin, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+_css_providers = {}
+
+
+def _acquire_css(display):
+    with _caches_lock:
+        item = _css_providers.get(display)
+        if item is None:
+            provider = Gtk.CssProvider()
+            provider.load_from_data(_WEATHER_CSS)
+            Gtk.StyleContext.add_provider_for_display(display, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+            item = [provider, 0]
+            _css_providers[display] = item
+        item[1] += 1
+
+
+def _release_css(display):
+    with _caches_lock:
+        item = _css_providers.get(display)
+        if item is None:
+            return
+        item[1] -= 1
+        if item[1] > 0:
+            return
+        del _css_providers[display]
+    Gtk.StyleContext.remove_provider_for_display(display, item[0])
+
+
+class _VisibilityLoader:
+    def __init__(self, widget, start, prefetch: float = 0.5):
+        self.widget = widget
+        self.start = start
+        self.prefetch = prefetch
+        self.cancel = None
+        self.done = False
+        self._scrolled = None
+        self._adj = None
+        self._adj_handler = None
+        widget.connect("map", self._on_map)
+        widget.connect("unmap", self._on_unmap)
+        widget.connect("destroy", self._on_destroy)
+
+    def _on_map(self, _w):
+        if self.done:
+            return
+        if self._adj is None:
+            self._scrolled = self.widget.get_ancestor(Gtk.ScrolledWindow)
+            if self._scrolled is not None:
+                self._adj = self._scrolled.get_vadjustment()
+                self._adj_handler = self._adj.connect("value-changed", lambda _a: self._check())
+        GLib.idle_add(self._check)
+
+    def _on_unmap(self, _w):
+        self._stop()
+        self._detach()
+
+    def _on_destroy(self, _w):
+        self._stop()
+        self._detach()
+
+    def _check(self):
+        if self.done or not self.widget.get_mapped():
+            return False
+        if self._in_view():
+            if self.cancel is None:
+                self.cancel = threading.Event()
+                self.start(self.cancel, self._finished)
+        else:
+            self._stop()
+        return False
+
+    def _in_view(self) -> bool:
+        if self._scrolled is None:
+            return True
+        res = self.widget.translate_coordinates(self._scrolled, 0, 0)
+        if not res or not res[0]:
+            return True
+        y = res[2]
+        view_h = self._scrolled.get_height()
+        margin = view_h * self.prefetch
+        return y + self.widget.get_height() >= -margin and y <= view_h + margin
+
+    def _finished(self, token):
+        if token is self.cancel and not token.is_set():
+            self.done = True
+            self.cancel = None
+            self._detach()
+        return False
+
+    def _stop(self):
+        if self.cancel is not None:
+            self.cancel.set()
+            self.cancel = None
+
+    def _detach(self):
+        if self._adj is not None and self._adj_handler is not None:
+            self._adj.disconnect(self._adj_handler)
+        self._adj = None
+        self._adj_handler = None
+        self._scrolled = None
+
+
+class _RefreshScheduler:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._subs = {}
+        self._seq = itertools.count()
+        self._thread = None
+        self.polls = 0
+        self.notifications = 0
+        self.errors = 0
+
+    def subscribe(self, key: str, coords, window: str, fetch, callback, due: float):
+        with self._cond:
+            sub = self._subs.get(key)
+            if sub is None:
+                sub = {"coords": coords, "window": window, "fetch": fetch, "callbacks": {}, "due": due}
+                self._subs[key] = sub
+                heapq.heappush(self._heap, (due, next(self._seq), key))
+            token = next(self._seq)
+            sub["callbacks"][token] = callback
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="newelle-weather-refresh", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return key, token
+
+    def unsubscribe(self, handle):
+        key, token = handle
+        with self._cond:
+            sub = self._subs.get(key)
+            if sub is None:
+                return
+            sub["callbacks"].pop(token, None)
+            if not sub["callbacks"]:
+                del self._subs[key]
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"locations": len(self._subs), "subscribers": sum(len(s["callbacks"]) for s in self._subs.values()),
+                    "polls": self.polls, "notifications": self.notifications, "errors": self.errors}
+
+    def _take_due(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    due, _, key = self._heap[0]
+                    sub = self._subs.get(key)
+                    if sub is not None and sub["due"] == due:
+                        break
+                    heapq.heappop(self._heap)
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            taken = []
+            while self._heap and self._heap[0][0] <= now:
+                due, _, key = heapq.heappop(self._heap)
+                sub = self._subs.get(key)
+                if sub is not None and sub["due"] == due:
+                    taken.append((key, sub))
+            return taken
+
+    def _reschedule(self, key, sub, due):
+        with self._cond:
+            if self._subs.get(key) is sub:
+                sub["due"] = due
+                heapq.heappush(self._heap, (due, next(self._seq), key))
+
+    def _run(self):
+        _request_ctx.background = True
+        while True:
+            groups = OrderedDict()
+            for key, sub in self._take_due():
+                groups.setdefault(sub["window"], []).append((key, sub))
+            for window, items in groups.items():
+                try:
+                    payloads = items[0][1]["fetch"]([sub["coords"] for _, sub in items], window)
+                except Exception:
+                    self.errors += 1
+                    retry = time.time() + _REFRESH_RETRY_SECS
+                    for key, sub in items:
+                        self._reschedule(key, sub, retry)
+                    continue
+                due = _next_model_update()
+                for (key, sub), data in zip(items, payloads):
+                    self.polls += 1
+                    with self._cond:
+                        callbacks = list(sub["callbacks"].values())
+                    for cb in callbacks:
+                        self.notifications += 1
+                        try:
+                            cb(data)
+                        except Exception:
+                            self.errors += 1
+                    self._reschedule(key, sub, due)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting_fg = 0
+        self.granted = 0
+        self.waited = 0.0
+
+    def acquire(self, background: bool = False):
+        t0 = time.monotonic()
+        with self._cond:
+            if not background:
+                self._waiting_fg += 1
+            try:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1 and (not background or self._waiting_fg == 0):
+                        self._tokens -= 1
+                        self.granted += 1
+                        self.waited += time.monotonic() - t0
+                        return
+                    self._cond.wait(max(0.01, (1 - self._tokens) / self.rate))
+            finally:
+                if not background:
+                    self._waiting_fg -= 1
+                self._cond.notify_all()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            self._refill()
+            if self._tokens >= 1 and self._waiting_fg == 0:
+                self._tokens -= 1
+                self.granted += 1
+                return True
+            return False
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill()
+            return {"tokens": round(self._tokens, 2), "granted": self.granted, "waited_s": round(self.waited, 3)}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+
+_request_ctx = threading.local()
+_limiter = _TokenBucket(_RATE_PER_SEC, _RATE_BURST)
+_hedge_executor = None
+_hedge_stats = {"hedged": 0, "hedge_won": 0}
+_hedge_lock = threading.Lock()
+
+
+def _is_background() -> bool:
+    return getattr(_request_ctx, "background", False)
+
+
+def _hedge_delay() -> float | None:
+    p95 = _metrics.percentile("http", 0.95, _HEDGE_MIN_SAMPLES)
+    if p95 is None:
+        return None
+    return max(_HEDGE_MIN_DELAY, p95)
+
+
+def _hedged_get(url: str) -> bytes:
+    global _hedge_executor
+    delay = _hedge_delay()
+    if delay is None:
+        return _http.get(url)
+    with _caches_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="newelle-weather-hedge")
+        executor = _hedge_executor
+    done = threading.Event()
+    box = {"conn": None, "aborted": False}
+    hedge = executor.submit(_hedge_fetch, url, time.monotonic() + delay, done, box)
+    try:
+        body = _http.get(url, box)
+    except Exception:
+        done.set()
+        result = None if hedge.cancel() else hedge.result()
+        if result is None:
+            raise
+        with _hedge_lock:
+            _hedge_stats["hedge_won"] += 1
+        return result
+    done.set()
+    return body
+
+
+def _hedge_fetch(url: str, deadline: float, done: threading.Event, box: dict) -> bytes | None:
+    if done.wait(max(0.0, deadline - time.monotonic())):
+        return None
+    slot = _host_slot(url)
+    if not slot.acquire(blocking=False):
+        return None
+    try:
+        if done.is_set() or not _limiter.try_acquire():
+            return None
+        with _hedge_lock:
+            _hedge_stats["hedged"] += 1
+        try:
+            body = _http.get(url)
+        except Exception:
+            return None
+    finally:
+        slot.release()
+    if not done.is_set():
+        box["aborted"] = True
+        conn = box["conn"]
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    return body
+
+
+class _WeatherItem(GObject.Object):
+    __gtype_name__ = "NewelleWeatherItem"
+
+    def __init__(self, req: dict, units: str, lang: str):
+        super().__init__()
+        self.req = req
+        self.units = units
+        self.lang = lang
+        self.entry = None
+        self.error = None
+        self.loading = False
+        self.card = None
+        self.watch = None
+        self.watch_args = None
+
+
+_refresher = _RefreshScheduler()
+_http = _HttpClient()
+_flight = _SingleFlight()
+
+
+def _diagnostics() -> dict:
+    with _caches_lock:
+        caches = dict(_caches)
+    with _hedge_lock:
+        hedging = dict(_hedge_stats)
+    timings = list(_http.timings)
+    return {
+        "phases": _metrics.snapshot(),
+        "caches": {name: cache.stats() for name, cache in caches.items()},
+        "single_flight": _flight.stats(),
+        "rate_limit": _limiter.stats(),
+        "hedging": hedging,
+        "refresh": _refresher.stats(),
+        "http": {"requests": len(timings), "reused": sum(1 for t in timings if t["reused"]),
+                 "bytes": sum(t["bytes"] for t in timings), "recent": timings[-20:]},
+    }
+_executor = None
+_host_slots = {}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _caches_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="newelle-weather")
+        return _executor
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urllib.parse.urlsplit(url).netloc
+    with _caches_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(_HOST_CONCURRENCY)
+            _host_slots[host] = slot
+        return slot
+
 
 class WeatherExtension(NewelleExtension):
     id = "weather_extension"
@@ -10,6 +1078,44 @@ class WeatherExtension(NewelleExtension):
     def get_replace_codeblocks_langs(self) -> list:
         return ["weather"]
 
+    def add_tab_menu_entries(self) -> list:
+        from .handlers import TabButtonDescription
+        return [TabButtonDescription("Weather diagnostics", "utilities-system-monitor-symbolic", lambda x, y: self._open_diagnostics_tab())]
+
+    def get_weather_diagnostics(self) -> dict:
+        return _diagnostics()
+
+    def dump_weather_diagnostics(self) -> str:
+        return json.dumps(_diagnostics(), indent=2)
+
+    def _open_diagnostics_tab(self):
+        root = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
+        root.set_margin_top(10); root.set_margin_bottom(10); root.set_margin_start(10); root.set_margin_end(10)
+        bar = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        btn_refresh = Gtk.Button(label="Refresh")
+        btn_copy = Gtk.Button(label="Copy JSON")
+        btn_reset = Gtk.Button(label="Reset timings")
+        bar.append(btn_refresh); bar.append(btn_copy); bar.append(btn_reset)
+        view = Gtk.TextView(editable=False, monospace=True)
+        scroll = Gtk.ScrolledWindow(hexpand=True, vexpand=True)
+        scroll.set_child(view)
+        root.append(bar); root.append(scroll)
+
+        def refresh(*_a):
+            view.get_buffer().set_text(self.dump_weather_diagnostics())
+        def copy(*_a):
+            root.get_clipboard().set(self.dump_weather_diagnostics())
+        def reset(*_a):
+            _metrics.reset()
+            refresh()
+        btn_refresh.connect("clicked", refresh)
+        btn_copy.connect("clicked", copy)
+        btn_reset.connect("clicked", reset)
+        refresh()
+        tab = self.ui_controller.add_tab(root)
+        tab.set_title("Weather diagnostics")
+        tab.set_icon(Gio.ThemedIcon.new("utilities-system-monitor-symbolic"))
+
     def get_extra_settings(self) -> list:
         return [
             {
@@ -27,6 +1133,20 @@ class WeatherExtension(NewelleExtension):
                 "type": "entry",
                 "default": "en",
             },
+            {
+                "key": "weather_gazetteer",
+                "title": "Offline gazetteer",
+                "description": "Path to a GeoNames-style TSV (e.g. cities15000.txt) used to resolve place names without the network",
+                "type": "entry",
+                "default": "",
+            },
+            {
+                "key": "weather_hedging",
+                "title": "Hedged requests",
+                "description": "Send a second request when a response is slower than usual and use whichever answers first",
+                "type": "toggle",
+                "default": False,
+            },
         ]
 
     def get_additional_prompts(self) -> list:
@@ -39,7 +1159,7 @@ class WeatherExtension(NewelleExtension):
                 "editable": True,
                 "show_in_settings": True,
                 "default": True,
-                "text": "Each line describes a request. Supported:\n- City or place name\n- City @ 2025-08-11 12:00\n- 55.75, 37.62\n- 55.75, 37.62 @ 2025-08-11T12:00\nGlobal overrides at top as key: value (units: metric|imperial, lang: en|ru|...).\nExample:\n```weather\nunits: metric\nlang: en\nMoscow @ 2025-08-11 12:00\n59.93, 30.33\n```"
+                "text": "Each line describes a request. Supported:\n- City or place name\n- City @ 2025-08-11 12:00\n- City @ 2025-08-11..2025-08-14 (hourly timeline)\n- 55.75, 37.62\n- 55.75, 37.62 @ 2025-08-11T12:00\nGlobal overrides at top as key: value (units: metric|imperial, lang: en|ru|...).\nComparison table: add `mode: table` and `times: 09:00, 2025-08-12 18:00, ...`; each location becomes a row.\nExample:\n```weather\nunits: metric\nlang: en\nMoscow @ 2025-08-11 12:00\n59.93, 30.33\n```"
             }
         ]
 
@@ -56,65 +1176,400 @@ class WeatherExtension(NewelleExtension):
         root.set_margin_start(10)
         root.set_margin_end(10)
 
-        css = Gtk.CssProvider()
-        css.load_from_data(b"""
-        .wx-card {
-            border-radius: 16px;
-            padding: 14px;
-            box-shadow: 0 10px 28px alpha(@theme_fg_color, 0.18);
-        }
-        .wx-sun { background-image: linear-gradient(135deg, #FFCF6F, #FF7E5F); color: #232323; }
-        .wx-cloud { background-image: linear-gradient(135deg, #B0BEC5, #90A4AE); color: #101417; }
-        .wx-rain { background-image: linear-gradient(135deg, #74ABE2, #5563DE); color: #0e1221; }
-        .wx-snow { background-image: linear-gradient(135deg, #E0F7FA, #B3E5FC); color: #143a4a; }
-        .wx-storm { background-image: linear-gradient(135deg, #7F7FD5, #86A8E7); color: #0f1330; }
-        .wx-night { background-image: linear-gradient(135deg, #1E3C72, #2A5298); color: #E8F1FF; }
-
-        .wx-title { font-weight: 800; font-size: 14px; letter-spacing: .2px; }
-        .wx-temp { font-size: 38px; font-weight: 900; }
-        .wx-subtle { opacity: .9; }
-        .wx-row { padding-top: 6px; }
-
-        .wx-chip {
-            background-color: alpha(@theme_bg_color, 0.18);
-            border-radius: 999px;
-            padding: 4px 8px;
-            font-weight: 600;
-        }
-        .wx-chip-box { border-spacing: 8px; }
-
-        .wx-cta {
-            border-radius: 999px;
-            padding: 8px 14px;
-            background-image: linear-gradient(135deg, #FF7E5F, #F83E6D);
-            color: white;
-            border: none;
-            box-shadow: 0 6px 18px rgba(248, 62, 109, 0.35);
-        }
-        .wx-cta:hover { filter: brightness(1.06); }
-        .wx-cta label { color: white; font-weight: 800; }
-        """)
-        Gtk.StyleContext.add_provider_for_display(root.get_display(), css, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        display = root.get_display()
+        _acquire_css(display)
+        root.connect("destroy", lambda _w: _release_css(display))
 
         units_pref = (globals_cfg.get("units") or self.get_setting("weather_units") or "metric").lower()
         lang_pref = (globals_cfg.get("lang") or self.get_setting("weather_lang") or "en").lower()
 
+        if (globals_cfg.get("mode") or "").lower() == "table":
+            times = [t.strip() for t in (globals_cfg.get("times") or "").split(",") if t.strip()]
+            root.append(self._build_table(requests, times, units_pref, lang_pref))
+            return root
+
+        if len(requests) > _VIRTUAL_THRESHOLD:
+            root.append(self._build_virtual_list(requests, units_pref, lang_pref))
+            return root
+
         cards = []
         for req in requests:
-            card = self._make_card_placeholder()
+            card = self._make_timeline_placeholder() if req.get("until") else self._make_card_placeholder()
             root.append(card["card"])
             cards.append((card, req, units_pref, lang_pref))
 
-        def worker():
-            for card, req, u, lng in cards:
+        def start(cancel, finished):
+            threading.Thread(target=self._load_cards, args=(cards, cancel, finished), daemon=True).start()
+        _VisibilityLoader(root, start)
+
+        return root
+
+    @_timed("block")
+    def _load_cards(self, cards, cancel: threading.Event | None = None, finished=None, fill=None, error=None, watch=None):
+        fill = fill or self._fill_card
+        error = error or self._error_card
+        watch = watch or self._watch_card
+        def post(fn, *args):
+            if cancel is None or not cancel.is_set():
+                GLib.idle_add(fn, *args)
+        executor = _get_executor()
+        located = [(c, executor.submit(self._resolve_location, c[1], c[3])) for c in cards]
+        groups = OrderedDict()
+        for (card, req, u, lng), fut in located:
+            if cancel is not None and cancel.is_set():
+                for _, f in located:
+                    f.cancel()
+                return
+            try:
+                lat, lon, name = fut.result()
+                window = self._forecast_window(req)
+            except Exception as e:
+                post(error, card, str(e))
+                continue
+            groups.setdefault(window, []).append((card, req, u, lat, lon, name))
+        for window, items in groups.items():
+            if cancel is not None and cancel.is_set():
+                return
+            try:
+                payloads = self._fetch_forecasts([(lat, lon) for _, _, _, lat, lon, _ in items], window, stale_ok=True)
+            except Exception as e:
+                for card, *_ in items:
+                    post(error, card, str(e))
+                continue
+            for (card, req, u, lat, lon, name), data in zip(items, payloads):
                 try:
-                    entry = self._resolve_and_fetch(req, u, lng)
-                    GLib.idle_add(self._fill_card, card, entry, u)
+                    entry = self._build_entry(req, lat, lon, name, data, u)
+                    post(fill, card, entry, u)
+                    post(watch, card, req, lat, lon, name, u, window)
                 except Exception as e:
-                    GLib.idle_add(self._error_card, card, str(e))
-        threading.Thread(target=worker, daemon=True).start()
+                    post(error, card, str(e))
+        if finished is not None:
+            post(finished, cancel)
 
-        return root
+    def _watch_card(self, card, req, lat, lon, name, units_pref, window):
+        if card.get("watch") is not None:
+            return False
+        card["watch"] = self._subscribe_refresh(req, lat, lon, name, units_pref, window, lambda entry: GLib.idle_add(self._refill_card, card, entry, units_pref))
+        if card["watch"] is not None and not card.get("watch_hooked"):
+            card["watch_hooked"] = True
+            card["card"].connect("unrealize", lambda _w: self._unwatch_card(card))
+            card["card"].connect("realize", lambda _w: self._watch_card(card, req, lat, lon, name, units_pref, window))
+        return False
+
+    def _unwatch_card(self, card):
+        if card.get("watch") is not None:
+            _refresher.unsubscribe(card["watch"])
+            card["watch"] = None
+
+    def _refill_card(self, card, entry, units_pref):
+        if card["card"].get_root() is None:
+            self._unwatch_card(card)
+            return False
+        return self._fill_card(card, entry, units_pref)
+
+    def _subscribe_refresh(self, req, lat, lon, name, units_pref, window, on_entry):
+        if window.startswith("archive:"):
+            return None
+        if self._window_ended(window):
+            return None
+        slat, slon = self._snap_coords(lat, lon)
+        key = self._forecast_key(slat, slon, window)
+        expires = _get_cache("forecast").peek_expiry(key)
+        def on_data(data):
+            on_entry(self._build_entry(req, lat, lon, name, data, units_pref))
+        return _refresher.subscribe(key, (slat, slon), window, self._fetch_forecasts, on_data, expires or time.time())
+
+    def _build_virtual_list(self, requests, units_pref, lang_pref):
+        store = Gio.ListStore(item_type=_WeatherItem)
+        for req in requests:
+            store.append(_WeatherItem(req, units_pref, lang_pref))
+        slots = {}
+        pending = []
+        gate = {"cancel": None}
+
+        def fill(item, entry, u):
+            item.entry, item.error, item.loading = entry, None, False
+            if item.card is not None:
+                self._fill_card(item.card, entry, u)
+            return False
+        def error(item, msg):
+            item.error, item.loading = msg, False
+            if item.card is not None:
+                self._error_card(item.card, msg)
+            return False
+        def refill(item, entry, u):
+            if scroll.get_root() is None:
+                unwatch_all(scroll)
+                return False
+            return fill(item, entry, u)
+        def watch(item, req, lat, lon, name, u, window):
+            item.watch_args = (req, lat, lon, name, u, window)
+            if item.watch is None:
+                item.watch = self._subscribe_refresh(req, lat, lon, name, u, window, lambda entry: GLib.idle_add(refill, item, entry, u))
+            return False
+        def unwatch_all(_w):
+            for item in store:
+                if item.watch is not None:
+                    _refresher.unsubscribe(item.watch)
+                    item.watch = None
+        def rewatch_all(_w):
+            for item in store:
+                if item.watch_args is not None:
+                    watch(item, *item.watch_args)
+        def flush():
+            cancel = gate["cancel"]
+            if cancel is None or cancel.is_set():
+                return False
+            batch = [(item, item.req, item.units, item.lang) for item in pending if item.entry is None and item.error is None]
+            pending.clear()
+            if batch:
+                threading.Thread(target=self._load_cards, args=(batch, cancel, None, fill, error, watch), daemon=True).start()
+            return False
+        def start(cancel, _finished):
+            gate["cancel"] = cancel
+            pending.clear()
+            for item in store:
+                item.loading = item.card is not None and item.entry is None and item.error is None
+                if item.loading:
+                    pending.append(item)
+            flush()
+
+        def on_setup(_f, list_item):
+            box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+            point = self._make_card_placeholder()
+            timeline = self._make_timeline_placeholder()
+            box.append(point["card"]); box.append(timeline["card"])
+            list_item.set_child(box)
+            slots[list_item] = (point, timeline)
+        def on_bind(_f, list_item):
+            item = list_item.get_item()
+            point, timeline = slots[list_item]
+            is_timeline = bool(item.req.get("until"))
+            point["card"].set_visible(not is_timeline)
+            timeline["card"].set_visible(is_timeline)
+            card = timeline if is_timeline else point
+            item.card = card
+            if item.entry is not None:
+                self._fill_card(card, item.entry, item.units)
+            elif item.error is not None:
+                self._error_card(card, item.error)
+            else:
+                self._reset_card(card)
+                if not item.loading:
+                    item.loading = True
+                    if not pending:
+                        GLib.timeout_add(50, flush)
+                    pending.append(item)
+        def on_unbind(_f, list_item):
+            item = list_item.get_item()
+            if item is not None:
+                item.card = None
+        def on_teardown(_f, list_item):
+            slots.pop(list_item, None)
+        def on_destroy(_w):
+            unwatch_all(_w)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", on_setup)
+        factory.connect("bind", on_bind)
+        factory.connect("unbind", on_unbind)
+        factory.connect("teardown", on_teardown)
+        view = Gtk.ListView(model=Gtk.NoSelection(model=store), factory=factory)
+        view.add_css_class("wx-list")
+        scroll = Gtk.ScrolledWindow(hexpand=True, vexpand=True)
+        scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scroll.set_min_content_height(_VIRTUAL_HEIGHT)
+        scroll.set_child(view)
+        scroll.connect("destroy", on_destroy)
+        scroll.connect("unrealize", unwatch_all)
+        scroll.connect("realize", rewatch_all)
+        frame = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, hexpand=True, vexpand=True)
+        frame.append(scroll)
+        _VisibilityLoader(frame, start)
+        return frame
+
+    def _build_table(self, requests, times, units_pref, lang_pref):
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        box.add_css_class("wx-table")
+        status = Gtk.Label(label="Loading…", xalign=0)
+        status.add_css_class("wx-subtle")
+        box.append(status)
+
+        def show(result):
+            rows, columns, err = result
+            if err:
+                status.set_text(err)
+                return False
+            status.set_visible(False)
+            box.append(self._table_grid(rows, columns, units_pref))
+            return False
+        def start(cancel, finished):
+            def work():
+                try:
+                    result = (*self._compute_table(requests, times, units_pref, lang_pref), None)
+                except Exception as e:
+                    result = ([], [], f"Weather error: {e}")
+                if not cancel.is_set():
+                    GLib.idle_add(show, result)
+                    GLib.idle_add(finished, cancel)
+            threading.Thread(target=work, daemon=True).start()
+        _VisibilityLoader(box, start)
+        return box
+
+    @_timed("table")
+    def _compute_table(self, requests, times, units_pref, lang_pref):
+        today = datetime.now().strftime("%Y-%m-%d")
+        targets = []
+        bad = []
+        for t in times or [None]:
+            if t is None:
+                targets.append((None, "Now"))
+                continue
+            clock = t.zfill(5) if len(t) == 4 and t[1] == ":" else t
+            iso = self._normalize_time(f"{today} {clock}" if len(clock) <= 5 else clock)
+            if iso is None:
+                bad.append(t)
+            else:
+                targets.append((iso, t))
+        if bad:
+            raise RuntimeError(f"Invalid time: {', '.join(bad)}")
+        isos = sorted(iso for iso, _ in targets if iso is not None)
+        window = self._forecast_window({"time": isos[0], "until": isos[-1]}) if isos else "now"
+        executor = _get_executor()
+        located = [executor.submit(self._resolve_location, req, lang_pref) for req in requests]
+        places = []
+        for req, fut in zip(requests, located):
+            try:
+                places.append(fut.result())
+            except Exception as e:
+                places.append((None, None, f"{req.get('name') or ''}: {e}"))
+        ok = [p for p in places if p[0] is not None]
+        payloads = iter(self._fetch_forecasts([(lat, lon) for lat, lon, _ in ok], window)) if ok else iter(())
+        rows = []
+        for lat, lon, name in places:
+            if lat is None:
+                rows.append((name, None))
+                continue
+            data = next(payloads)
+            picks = self._pick_hour_indices(data, [iso or data.current_time for iso, _ in targets])
+            cells = []
+            for i, _, iso in picks:
+                t = data.value("temperature_2m", i, units_pref); c = data.value("weathercode", i)
+                hour = int(iso[11:13]) if len(iso) >= 13 else 12
+                cells.append((t, int(c) if c is not None else 0, hour < 6 or hour >= 21, iso.replace("T", " ")))
+            rows.append((name or f"{lat:.3f},{lon:.3f}", cells))
+        return rows, [label for _, label in targets]
+
+    def _table_grid(self, rows, columns, units_pref):
+        units_temp = "°F" if units_pref == "imperial" else "°C"
+        grid = Gtk.Grid(column_spacing=12, row_spacing=6)
+        for j, label in enumerate(columns):
+            head = Gtk.Label(label=label, xalign=0.5)
+            head.add_css_class("wx-head")
+            grid.attach(head, j + 1, 0, 1, 1)
+        for r, (name, cells) in enumerate(rows, start=1):
+            title = Gtk.Label(label=name, xalign=0)
+            title.add_css_class("wx-title")
+            grid.attach(title, 0, r, 1, 1)
+            if cells is None:
+                continue
+            for j, (t, code, night, when) in enumerate(cells):
+                icon_name, desc = self._icon_and_desc(code, night)
+                cell = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+                cell.add_css_class("wx-cell")
+                cell.set_tooltip_text(f"{desc} · {when}")
+                cell.append(Gtk.Image.new_from_icon_name(icon_name))
+                cell.append(Gtk.Label(label=f"{round(t):d}{units_temp}" if t is not None else "—"))
+                grid.attach(cell, j + 1, r, 1, 1)
+        scroll = Gtk.ScrolledWindow(hexpand=True)
+        scroll.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.NEVER)
+        scroll.set_child(grid)
+        return scroll
+
+    def _reset_card(self, card):
+        self._set_label(card["title"], "Loading…")
+        self._set_label(card["temp"], "--°")
+        self._set_label(card["summary"], "")
+        self._set_label(card["timez"], "")
+        card["link"] = None
+        card["cta"].set_sensitive(False)
+        for key, icon in (("chip1", "weather-clear-symbolic"), ("chip2", "weather-windy-symbolic"), ("chip3", "weather-showers-symbolic")):
+            if key in card:
+                self._set_chip(card[key], "", icon)
+        if card.get("bg") is not None:
+            card["card"].remove_css_class(card["bg"])
+            card["bg"] = None
+        if "series" in card and (card["series"] or card["precip_series"]):
+            card["series"], card["precip_series"] = [], []
+            card["area"].queue_draw()
+
+    def _make_timeline_placeholder(self):
+        card = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
+        card.add_css_class("wx-card")
+        title_row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        title = Gtk.Label(label="Loading…", xalign=0); title.add_css_class("wx-title"); title.set_hexpand(True)
+        cta = Gtk.Button()
+        cta.add_css_class("wx-cta")
+        cta.set_child(Gtk.Label(label="Learn more"))
+        cta.set_sensitive(False)
+        cta.connect("clicked", lambda _b: self._open_more(card_ref))
+        title_row.append(title); title_row.append(cta)
+        temp = Gtk.Label(label="--°", xalign=0); temp.add_css_class("wx-temp")
+        summary = Gtk.Label(label="", xalign=0); summary.add_css_class("wx-subtle")
+        timez = Gtk.Label(label="", xalign=0); timez.add_css_class("wx-subtle")
+        area = Gtk.DrawingArea()
+        area.set_content_height(72)
+        area.set_hexpand(True)
+        card.append(title_row); card.append(temp); card.append(area); card.append(summary); card.append(timez)
+        card_ref = {"card": card, "title": title, "cta": cta, "temp": temp, "summary": summary, "timez": timez, "area": area, "series": [], "precip_series": []}
+        area.set_draw_func(lambda _a, cr, w, h: self._draw_sparkline(card_ref, cr, w, h))
+        return card_ref
+
+    def _fill_timeline(self, card, entry, units_pref):
+        units_temp = "°F" if units_pref == "imperial" else "°C"
+        units_precip = "in" if units_pref == "imperial" else "mm"
+        name = entry.name or f"{entry.lat:.3f},{entry.lon:.3f}"
+        tz = entry.timezone or ""
+        _, desc = self._icon_and_desc(entry.weathercode, False)
+        self._set_label(card["title"], name)
+        self._set_label(card["temp"], f"{round(entry.temp_min):d}{units_temp} – {round(entry.temp_max):d}{units_temp}")
+        self._set_label(card["summary"], f"{desc} · mean {entry.temperature:.1f}{units_temp} · precip {entry.precip_total:.1f} {units_precip} · {entry.hours} h")
+        self._set_label(card["timez"], entry.local_time_str + (f" · {tz}" if tz else ""))
+        self._set_bg(card, self._bg_class(entry.weathercode, False))
+        if card["series"] != entry.series or card["precip_series"] != entry.precip_series:
+            card["series"] = entry.series
+            card["precip_series"] = entry.precip_series
+            card["area"].queue_draw()
+        card["link"] = (self._windy_link(entry.lat, entry.lon, entry.iso_time), name)
+        card["cta"].set_sensitive(True)
+        return False
+
+    def _draw_sparkline(self, card, cr, w, h):
+        try:
+            fg = card["area"].get_color()
+            r, g, b = fg.red, fg.green, fg.blue
+        except Exception:
+            r, g, b = 1.0, 1.0, 1.0
+        pad = 4
+        iw = max(1, w - 2 * pad); ih = max(1, h - 2 * pad)
+        precip = card["precip_series"]
+        if precip:
+            cr.set_source_rgba(r, g, b, 0.25)
+            bar = max(1.0, iw / max(1, len(precip)))
+            for x, y in precip:
+                if y > 0:
+                    cr.rectangle(pad + x * iw - bar / 2, pad + ih * (1 - y), bar, ih * y)
+            cr.fill()
+        series = card["series"]
+        if len(series) >= 2:
+            cr.set_source_rgba(r, g, b, 0.95)
+            cr.set_line_width(2)
+            cr.set_line_join(cairo.LINE_JOIN_ROUND)
+            x, y = series[0]
+            cr.move_to(pad + x * iw, pad + ih * (1 - y))
+            for x, y in series[1:]:
+                cr.line_to(pad + x * iw, pad + ih * (1 - y))
+            cr.stroke()
 
     def _make_card_placeholder(self):
         card = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -125,6 +1580,7 @@ class WeatherExtension(NewelleExtension):
         cta.add_css_class("wx-cta")
         cta.set_child(Gtk.Label(label="Learn more"))
         cta.set_sensitive(False)
+        cta.connect("clicked", lambda _b: self._open_more(card_ref))
         title_row.append(title); title_row.append(cta)
 
         main = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
@@ -144,7 +1600,8 @@ class WeatherExtension(NewelleExtension):
         chips.append(chip1); chips.append(chip2); chips.append(chip3)
 
         card.append(title_row); card.append(main); card.append(chips)
-        return {"card": card, "title": title, "cta": cta, "icon": icon, "temp": temp, "summary": summary, "timez": timez, "chip1": chip1, "chip2": chip2, "chip3": chip3}
+        card_ref = {"card": card, "title": title, "cta": cta, "icon": icon, "temp": temp, "summary": summary, "timez": timez, "chip1": chip1, "chip2": chip2, "chip3": chip3}
+        return card_ref
 
     def _chip(self, text, icon_name):
         b = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
@@ -154,27 +1611,32 @@ class WeatherExtension(NewelleExtension):
         b.append(i); b.append(l)
         return b
 
+    @_timed("fill")
     def _fill_card(self, card, entry, units_pref):
-        name = entry.get("name") or f"{entry['lat']:.3f},{entry['lon']:.3f}"
-        wcode = entry["weathercode"]
-        is_night = entry["is_night"]
-        temp = entry["temperature"]
-        app_temp = entry.get("apparent_temperature")
-        rh = entry.get("humidity")
-        wind = entry.get("windspeed")
-        pop = entry.get("precip_prob")
-        precip = entry.get("precip")
-        tz = entry.get("timezone", "")
+        if entry.series is not None:
+            return self._fill_timeline(card, entry, units_pref)
+        name = entry.name or f"{entry.lat:.3f},{entry.lon:.3f}"
+        wcode = entry.weathercode
+        is_night = entry.is_night
+        temp = entry.temperature
+        app_temp = entry.apparent_temperature
+        rh = entry.humidity
+        wind = entry.windspeed
+        pop = entry.precip_prob
+        precip = entry.precip
+        tz = entry.timezone or ""
         units_temp = "°F" if units_pref == "imperial" else "°C"
         units_wind = "mph" if units_pref == "imperial" else "km/h"
         units_precip = "in" if units_pref == "imperial" else "mm"
 
-        card["title"].set_text(name)
+        self._set_label(card["title"], name)
         icon_name, desc = self._icon_and_desc(wcode, is_night)
-        card["icon"].set_from_icon_name(icon_name)
-        card["temp"].set_text(f"{round(temp):d}{units_temp}" if not math.isnan(temp) else f"--{units_temp}")
-        card["summary"].set_text(desc)
-        card["timez"].set_text(entry["local_time_str"] + (f" · {tz}" if tz else ""))
+        if card.get("icon_name") != icon_name:
+            card["icon"].set_from_icon_name(icon_name)
+            card["icon_name"] = icon_name
+        self._set_label(card["temp"], f"{round(temp):d}{units_temp}" if not math.isnan(temp) else f"--{units_temp}")
+        self._set_label(card["summary"], desc)
+        self._set_label(card["timez"], entry.local_time_str + (f" · {tz}" if tz else ""))
 
         c1 = f"Feels like: {round(app_temp):d}{units_temp}" if app_temp is not None else ""
         c2 = f"Wind: {round(wind)} {units_wind}" if wind is not None else ""
@@ -187,91 +1649,310 @@ class WeatherExtension(NewelleExtension):
         self._set_chip(card["chip2"], c2, "weather-windy-symbolic")
         self._set_chip(card["chip3"], c3, "weather-showers-symbolic")
 
-        for cls in ("wx-sun","wx-cloud","wx-rain","wx-snow","wx-storm","wx-night"):
-            card["card"].remove_css_class(cls)
-        card["card"].add_css_class(self._bg_class(wcode, is_night))
-
-        lat = entry["lat"]; lon = entry["lon"]; when = entry["iso_time"]
-        url = self._windy_link(lat, lon, when)
-        def open_more(_b):
-            tab = self.ui_controller.new_browser_tab(url, new=True)
-            if tab:
-                tab.set_title(f"Weather · {name}")
-                tab.set_icon(Gio.ThemedIcon.new("globe-symbolic"))
-        card["cta"].connect("clicked", open_more)
+        self._set_bg(card, self._bg_class(wcode, is_night))
+
+        lat = entry.lat; lon = entry.lon; when = entry.iso_time
+        card["link"] = (self._windy_link(lat, lon, when), name)
         card["cta"].set_sensitive(True)
         return False
 
+    def _open_more(self, card):
+        link = card.get("link")
+        if link is None:
+            return
+        url, name = link
+        tab = self.ui_controller.new_browser_tab(url, new=True)
+        if tab:
+            tab.set_title(f"Weather · {name}")
+            tab.set_icon(Gio.ThemedIcon.new("globe-symbolic"))
+
+    def _set_label(self, label, text):
+        if label.get_text() != text:
+            label.set_text(text)
+
+    def _set_bg(self, card, cls):
+        if card.get("bg") == cls:
+            return
+        for c in ("wx-sun","wx-cloud","wx-rain","wx-snow","wx-storm","wx-night"):
+            card["card"].remove_css_class(c)
+        card["card"].add_css_class(cls)
+        card["bg"] = cls
+
     def _set_chip(self, chip_box, text, icon_name):
         children = list(chip_box)
         if len(children) == 2 and isinstance(children[1], Gtk.Label):
-            if isinstance(children[0], Gtk.Image):
+            if isinstance(children[0], Gtk.Image) and children[0].get_icon_name() != icon_name:
                 children[0].set_from_icon_name(icon_name)
-            children[1].set_text(text or "—")
+            self._set_label(children[1], text or "—")
 
     def _error_card(self, card, msg):
         card["title"].set_text("Weather error")
         card["summary"].set_text(msg)
         card["temp"].set_text("--")
         card["cta"].set_sensitive(False)
-        for cls in ("wx-sun","wx-cloud","wx-rain","wx-snow","wx-storm","wx-night"):
-            card["card"].remove_css_class(cls)
-        card["card"].add_css_class("wx-storm")
+        self._set_bg(card, "wx-storm")
         return False
 
-    def _resolve_and_fetch(self, req, units_pref: str, lang: str):
-        lat, lon, name = None, None, req.get("name", "")
+    def _resolve_location(self, req, lang: str):
         if "lat" in req and "lon" in req:
-            lat, lon = float(req["lat"]), float(req["lon"])
-        else:
-            lat, lon, name = self._geocode_first(name, lang)
-        if units_pref == "imperial":
-            unit_params = {"temperature_unit": "fahrenheit","windspeed_unit": "mph","precipitation_unit": "inch","timeformat": "iso8601"}
-        else:
-            unit_params = {"temperature_unit": "celsius","windspeed_unit": "kmh","precipitation_unit": "mm","timeformat": "iso8601"}
-        hourly_vars = ["temperature_2m","apparent_temperature","weathercode","relativehumidity_2m","precipitation_probability","precipitation","windspeed_10m"]
-        params = {"latitude": f"{lat:.6f}","longitude": f"{lon:.6f}","hourly": ",".join(hourly_vars),"current_weather": "true","timezone": "auto"}
+            return float(req["lat"]), float(req["lon"]), req.get("name") or ""
+        return self._geocode_first(req.get("name", ""), lang)
+
+    def _forecast_window(self, req) -> str:
+        if req.get("time") is None:
+            return "now"
+        target_iso = self._normalize_time(req["time"])
+        if target_iso is None:
+            return "now"
+        first = last = target_iso[:10]
+        if req.get("until"):
+            until_iso = self._normalize_time(req["until"])
+            if until_iso is None:
+                raise RuntimeError("Invalid end time")
+            first, last = sorted((first, until_iso[:10]))
+        if self._in_archive_range(first) and self._in_archive_range(last):
+            return f"archive:{first}..{last}"
+        if not (self._in_forecast_range(first) and self._in_forecast_range(last)):
+            raise RuntimeError("Date outside available range")
+        return f"{first}..{last}" if first != last or req.get("until") else first
+
+    def _window_ended(self, window: str) -> bool:
+        if window == "now":
+            return False
+        delta = self._day_delta(window.partition("..")[2] or window)
+        return delta is not None and delta < 0
+
+    def _day_delta(self, day: str) -> int | None:
+        try:
+            return (datetime.fromisoformat(day).date() - datetime.now().date()).days
+        except ValueError:
+            return None
+
+    def _in_forecast_range(self, day: str) -> bool:
+        delta = self._day_delta(day)
+        return delta is not None and -_FORECAST_PAST_DAYS + 1 < delta < _FORECAST_MAX_DAYS
+
+    def _in_archive_range(self, day: str) -> bool:
+        delta = self._day_delta(day)
+        return delta is not None and delta <= -_FORECAST_PAST_DAYS + 1
+
+    def _window_params(self, window: str) -> dict:
+        if window == "now":
+            return {"forecast_days": "1", "current_weather": "true"}
+        first, _, last = window.partition("..")
+        return {"start_date": first, "end_date": last or first}
+
+    def _forecast_key(self, slat: float, slon: float, window: str):
+        return f"forecast|{slat:.2f},{slon:.2f}|{window}"
+
+    @_timed("forecast")
+    def _fetch_forecasts(self, coords: list, window: str, stale_ok: bool = False) -> list:
+        if window.startswith("archive:"):
+            return self._fetch_archives(coords, window)
+        cache = _get_cache("forecast")
+        now = time.time()
+        ended = self._window_ended(window)
+        expires_at = None if ended else _next_model_update(now)
+        snapped = [self._snap_coords(lat, lon) for lat, lon in coords]
+        results = [None] * len(coords)
+        missing = OrderedDict()
+        for i, (slat, slon) in enumerate(snapped):
+            data, expires = cache.get_entry(self._forecast_key(slat, slon, window))
+            if data is not None and (expires is None or expires > now or (stale_ok and not ended)):
+                results[i] = data
+            else:
+                missing.setdefault((slat, slon), []).append(i)
+        pending, waiting = [], []
+        for (slat, slon), idxs in missing.items():
+            key = self._forecast_key(slat, slon, window)
+            fut, owner = _flight.claim(key)
+            if owner:
+                pending.append(((slat, slon), key, idxs))
+            else:
+                waiting.append((fut, idxs))
+        try:
+            for start in range(0, len(pending), _BATCH_MAX_LOCATIONS):
+                chunk = pending[start:start + _BATCH_MAX_LOCATIONS]
+                payloads = self._request_forecasts([c for c, _, _ in chunk], window)
+                for (_, key, idxs), data in zip(chunk, payloads):
+                    cache.put(key, data, expires_at)
+                    _flight.resolve(key, data)
+                    for i in idxs:
+                        results[i] = data
+        except BaseException as e:
+            for _, key, _ in pending:
+                _flight.resolve(key, error=e)
+            raise
+        for fut, idxs in waiting:
+            data = fut.result()
+            for i in idxs:
+                results[i] = data
+        return results
+
+    def _request_forecasts(self, coords: list, window: str) -> list:
+        unit_params = {"temperature_unit": "celsius","windspeed_unit": "kmh","precipitation_unit": "mm","timeformat": "iso8601"}
+        params = {"latitude": ",".join(f"{lat:.2f}" for lat, _ in coords),"longitude": ",".join(f"{lon:.2f}" for _, lon in coords),"hourly": ",".join(_HOURLY_VARS),"timezone": "auto"}
+        params.update(self._window_params(window))
         params.update(unit_params)
-        url = "https://api.open-meteo.com/v1/forecast?" + urllib.parse.urlencode(params)
+        url = _FORECAST_URL + "?" + urllib.parse.urlencode(params, safe=",")
         data = self._http_json(url)
+        payloads = data if isinstance(data, list) else [data]
+        if len(payloads) != len(coords):
+            raise RuntimeError("Unexpected forecast response")
+        return [_ForecastSeries.from_payload(p) for p in payloads]
+
+    def _fetch_archives(self, coords: list, window: str) -> list:
+        first, _, last = window[len("archive:"):].partition("..")
+        start = datetime.fromisoformat(first).date()
+        days = [date.fromordinal(o).isoformat() for o in range(start.toordinal(), datetime.fromisoformat(last or first).date().toordinal() + 1)]
+        snapped = [self._snap_coords(lat, lon) for lat, lon in coords]
+        cache = _get_cache("archive")
+        by_place = {}
+        missing = OrderedDict()
+        for slat, slon in dict.fromkeys(snapped):
+            by_day = {d: cache.get(f"archive|{slat:.2f},{slon:.2f}|{d}") for d in days}
+            by_place[(slat, slon)] = by_day
+            gap = [d for d in days if by_day[d] is None]
+            if gap:
+                missing.setdefault((gap[0], gap[-1]), []).append((slat, slon))
+        for (lo, hi), places in missing.items():
+            for i in range(0, len(places), _BATCH_MAX_LOCATIONS):
+                chunk = places[i:i + _BATCH_MAX_LOCATIONS]
+                key = "archive|" + ";".join(f"{slat:.2f},{slon:.2f}" for slat, slon in chunk) + f"|{lo}..{hi}"
+                fetched = _flight.do(key, lambda: self._request_archive(chunk, lo, hi))
+                for (slat, slon), split in zip(chunk, fetched):
+                    by_day = by_place[(slat, slon)]
+                    for d in days:
+                        if by_day[d] is None and d in split:
+                            cache.put(f"archive|{slat:.2f},{slon:.2f}|{d}", split[d], None)
+                            by_day[d] = split[d]
+        results = []
+        for place in snapped:
+            by_day = by_place[place]
+            merged = _ForecastSeries.concat([by_day[d] for d in days if by_day[d] is not None])
+            if not len(merged):
+                raise RuntimeError("No archive data for this date")
+            results.append(merged)
+        return results
+
+    def _request_archive(self, places: list, first: str, last: str) -> list:
+        hourly_vars = [v for v in _HOURLY_VARS if v != "precipitation_probability"]
+        params = {"latitude": ",".join(f"{slat:.2f}" for slat, _ in places),"longitude": ",".join(f"{slon:.2f}" for _, slon in places),
+                  "start_date": first,"end_date": last,"hourly": ",".join(hourly_vars),"timezone": "auto","timeformat": "iso8601"}
+        data = self._http_json(_ARCHIVE_URL + "?" + urllib.parse.urlencode(params, safe=","))
+        payloads = data if isinstance(data, list) else [data]
+        if len(payloads) != len(places):
+            raise RuntimeError("Unexpected archive response")
+        return [_ForecastSeries.from_payload(p).split_days() for p in payloads]
+
+    def _build_entry(self, req, lat: float, lon: float, name: str, data: _ForecastSeries, units_pref: str = "metric") -> _WeatherEntry:
+        if req.get("until"):
+            return self._build_timeline_entry(req, lat, lon, name, data, units_pref)
         target_iso = None
         if req.get("time") is not None:
             target_iso = self._normalize_time(req["time"])
         idx, local_time_str, iso_time = self._pick_hour_index(data, target_iso)
-        hourly = data.get("hourly", {})
-        def g(k): return hourly.get(k, [])
-        wcode = self._safe_get(g("weathercode"), idx)
-        temp = self._safe_get(g("temperature_2m"), idx)
-        app_temp = self._safe_get(g("apparent_temperature"), idx)
-        rh = self._safe_get(g("relativehumidity_2m"), idx)
-        pop = self._safe_get(g("precipitation_probability"), idx)
-        precip = self._safe_get(g("precipitation"), idx)
-        wind = self._safe_get(g("windspeed_10m"), idx)
+        def g(k): return data.value(k, idx, units_pref)
+        wcode = g("weathercode")
+        temp = g("temperature_2m")
+        app_temp = g("apparent_temperature")
+        rh = g("relativehumidity_2m")
+        pop = g("precipitation_probability")
+        precip = g("precipitation")
+        wind = g("windspeed_10m")
         try:
             hour = int(iso_time[11:13]); is_night = hour < 6 or hour >= 21
         except Exception:
             is_night = False
-        return {"name": name,"lat": lat,"lon": lon,"timezone": data.get("timezone", ""), "iso_time": iso_time,"local_time_str": local_time_str,"weathercode": int(wcode) if wcode is not None else 0,"temperature": float(temp) if temp is not None else math.nan,"apparent_temperature": float(app_temp) if app_temp is not None else None,"humidity": int(rh) if rh is not None else None,"precip_prob": int(pop) if pop is not None else None,"precip": float(precip) if precip is not None else None,"windspeed": float(wind) if wind is not None else None,"is_night": is_night}
+        return _WeatherEntry(name=name, lat=lat, lon=lon, timezone=data.timezone, iso_time=iso_time, local_time_str=local_time_str,
+                             weathercode=int(wcode) if wcode is not None else 0, temperature=temp if temp is not None else math.nan,
+                             apparent_temperature=app_temp, humidity=int(rh) if rh is not None else None, precip_prob=int(pop) if pop is not None else None,
+                             precip=precip, windspeed=wind, is_night=is_night)
+
+    def _build_timeline_entry(self, req, lat: float, lon: float, name: str, data: _ForecastSeries, units_pref: str) -> _WeatherEntry:
+        start_iso = self._normalize_time(req.get("time"))
+        end_iso = self._normalize_time(req.get("until"))
+        if start_iso is None or end_iso is None:
+            raise RuntimeError("Invalid time range")
+        if len(str(req["until"]).strip()) == 10:
+            end_iso = end_iso[:11] + "23:00"
+        if end_iso < start_iso:
+            start_iso, end_iso = end_iso, start_iso
+        (i0, start_str, _), (i1, end_str, _) = self._pick_hour_indices(data, [start_iso, end_iso])
+        temps = data.values("temperature_2m", i0, i1 + 1, units_pref)
+        precs = data.values("precipitation", i0, i1 + 1, units_pref)
+        codes = [int(c) for c in data.values("weathercode", i0, i1 + 1) if c is not None]
+        valid = [v for v in temps if v is not None]
+        if not valid:
+            raise RuntimeError("No hourly data for this range")
+        wcode = max(set(codes), key=codes.count) if codes else 0
+        return _WeatherEntry(name=name, lat=lat, lon=lon, timezone=data.timezone, iso_time=start_iso,
+                             local_time_str=f"{start_str} – {end_str}", weathercode=wcode, is_night=False,
+                             temperature=sum(valid) / len(valid), temp_min=min(valid), temp_max=max(valid),
+                             precip_total=sum(v for v in precs if v is not None), hours=len(temps),
+                             series=self._sparkline_points(temps), precip_series=self._sparkline_points(precs, lower=0.0))
+
+    def _sparkline_points(self, values: list, lower: float | None = None) -> list:
+        pts = [(i, v) for i, v in enumerate(values) if v is not None]
+        if not pts:
+            return []
+        n = len(values)
+        if len(pts) > _SPARKLINE_MAX_POINTS:
+            buckets = _SPARKLINE_MAX_POINTS // 2
+            size = len(pts) / buckets
+            out = []
+            for b in range(buckets):
+                chunk = pts[int(b * size):int((b + 1) * size)]
+                if not chunk:
+                    continue
+                lo = min(chunk, key=lambda p: p[1]); hi = max(chunk, key=lambda p: p[1])
+                out.extend(sorted({lo, hi}))
+            pts = out
+        vmin = min(v for _, v in pts) if lower is None else min(lower, min(v for _, v in pts))
+        vmax = max(v for _, v in pts)
+        span = (vmax - vmin) or 1.0
+        denom = max(1, n - 1)
+        return [(i / denom, (v - vmin) / span) for i, v in pts]
+
+    def _snap_coords(self, lat: float, lon: float):
+        return round(lat, 2), round(lon, 2)
 
+    @_timed("geocode")
     def _geocode_first(self, name: str, lang: str):
         q = name.strip()
         if not q:
             raise RuntimeError("Empty place name")
-        url = "https://geocoding-api.open-meteo.com/v1/search?" + urllib.parse.urlencode({"name": q,"count": 1,"language": lang or "en","format": "json"})
-        data = self._http_json(url)
+        cache = _get_cache("geocode")
+        key = f"geocode|{(lang or 'en').lower()}|{_normalize_place(q)}"
+        hit = cache.get(key)
+        if hit is not None:
+            return hit[0], hit[1], hit[2]
+        gaz = _get_gazetteer(self.get_setting("weather_gazetteer") or "")
+        if gaz is not None:
+            found = gaz.lookup(q)
+            if found is not None:
+                return found
+        url = _GEOCODE_URL + "?" + urllib.parse.urlencode({"name": q,"count": 1,"language": lang or "en","format": "json"})
+        data = _flight.do(key, lambda: self._http_json(url))
         results = data.get("results") or []
         if not results:
-            raise RuntimeError(f"Place not found: {q}")
+            head = q.split(",")[0]
+            hints = [gaz.display[i] for i in gaz.complete(head, 3)] if gaz is not None and len(_normalize_place(head)) >= _GAZETTEER_MIN_PREFIX else []
+            raise RuntimeError(f"Place not found: {q}" + (f" (did you mean {', '.join(hints)}?)" if hints else ""))
         r = results[0]
         nm = r.get("name", q); cc = r.get("country_code", ""); admin = r.get("admin1", "")
         display = nm + (f", {admin}" if admin else "") + (f" ({cc})" if cc else "")
-        return float(r["latitude"]), float(r["longitude"]), display
+        lat, lon = float(r["latitude"]), float(r["longitude"])
+        cache.put(key, [lat, lon, display], time.time() + _GEOCODE_TTL_SECS)
+        return lat, lon, display
 
     def _http_json(self, url: str):
-        req = urllib.request.Request(url, headers={"User-Agent": "Newelle-Weather/1.0"})
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            raw = resp.read()
-        return json.loads(raw.decode("utf-8"))
+        _limiter.acquire(_is_background())
+        with _host_slot(url):
+            with _metrics.span("http"):
+                raw = _hedged_get(url) if self.get_setting("weather_hedging") else _http.get(url)
+        with _metrics.span("json_decode"):
+            return json.loads(raw.decode("utf-8"))
 
     def _normalize_time(self, t):
         s = str(t).strip().replace("T", " ")
@@ -283,41 +1964,38 @@ class WeatherExtension(NewelleExtension):
             return None
         return dt.strftime("%Y-%m-%dT%H:00")
 
-    def _pick_hour_index(self, data, target_iso: str | None):
-        hourly = data.get("hourly", {})
-        times = hourly.get("time") or []
-        if not times:
-            cw = data.get("current_weather") or {}
-            iso = cw.get("time", "")
-            local = iso.replace("T", " ")
-            return 0, local, iso
+    def _pick_hour_index(self, data: _ForecastSeries, target_iso: str | None):
+        if not len(data):
+            iso = data.current_time or ""
+            return 0, iso.replace("T", " "), iso
         if target_iso is None:
-            cw_iso = (data.get("current_weather") or {}).get("time")
-            if cw_iso and cw_iso in times:
-                idx = times.index(cw_iso)
-                return idx, cw_iso.replace("T", " "), cw_iso
-            iso = times[-1]
-            return len(times) - 1, iso.replace("T", " "), iso
-        best_i = 0; best_diff = 10**9
-        for i, iso in enumerate(times):
+            if data.current_time:
+                return self._pick_hour_indices(data, [data.current_time])[0]
+            iso = data.time_iso(len(data) - 1)
+            return len(data) - 1, iso.replace("T", " "), iso
+        return self._pick_hour_indices(data, [target_iso])[0]
+
+    @_timed("hour_select")
+    def _pick_hour_indices(self, data: _ForecastSeries, target_isos: list) -> list:
+        axis = data.hours
+        out = []
+        for target_iso in target_isos:
             try:
-                d = abs(self._iso_to_tuple(iso) - self._iso_to_tuple(target_iso))
-                if d < best_diff:
-                    best_diff = d; best_i = i
+                t = _iso_to_hours(target_iso)
             except Exception:
-                pass
-        iso = times[best_i]
-        return best_i, iso.replace("T", " "), iso
+                t = None
+            i = self._nearest_index(axis, t) if t is not None and axis else 0
+            iso = data.time_iso(i) if axis else ""
+            out.append((i, iso.replace("T", " "), iso))
+        return out
 
-    def _iso_to_tuple(self, s):
-        y = int(s[0:4]); m = int(s[5:7]); d = int(s[8:10]); h = int(s[11:13])
-        return (((y * 100) + m) * 100 + d) * 100 + h
-
-    def _safe_get(self, arr, i):
-        try:
-            return arr[i]
-        except Exception:
-            return None
+    def _nearest_index(self, axis, t: int) -> int:
+        i = bisect.bisect_left(axis, t)
+        if i >= len(axis):
+            return len(axis) - 1
+        if i > 0 and t - axis[i - 1] <= axis[i] - t:
+            return i - 1
+        return i
 
     def _icon_and_desc(self, code: int, night: bool):
         mapping_day = {
@@ -381,7 +2059,7 @@ class WeatherExtension(NewelleExtension):
         globals_cfg = {}
         requests = []
         for l in lines:
-            if ":" in l and l.split(":", 1)[0].lower() in ("units", "lang"):
+            if ":" in l and l.split(":", 1)[0].strip().lower() in ("units", "lang", "mode", "times"):
                 k, v = l.split(":", 1)
                 globals_cfg[k.strip().lower()] = v.strip()
                 continue
@@ -390,15 +2068,19 @@ class WeatherExtension(NewelleExtension):
                 loc = loc.strip(); t = t.strip()
             else:
                 loc, t = l, None
+            extra = {}
+            if t and ".." in t:
+                t, until = [p.strip() for p in t.split("..", 1)]
+                extra["until"] = until
             if "," in loc:
                 parts = [p.strip() for p in loc.split(",")]
                 if len(parts) >= 2:
                     try:
                         lat = float(parts[0]); lon = float(parts[1])
-                        requests.append({"lat": lat, "lon": lon, "time": t, "name": None})
+                        requests.append({"lat": lat, "lon": lon, "time": t, "name": None, **extra})
                         continue
                     except Exception:
                         pass
             if loc:
-                requests.append({"name": loc, "time": t})
+                requests.append({"name": loc, "time": t, **extra})
         return requests, globals_cfg
\ No newline at end of file